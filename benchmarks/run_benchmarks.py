@@ -0,0 +1,240 @@
+#time every stage and the single-pass pipeline on synthetic corpora, and compare with a stored baseline
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fitz
+import pytesseract
+from PIL import Image
+
+from synthetic_pdfs import KINDS, make_pdf
+from main import batch_process_pdfs
+from extract_double_image_jpg import ImageSplitter, split_files
+from extract_images_completly import ImageContentExtractor
+from extract_text_from_img_to_xls import make_row, ocr_image
+from output_sinks import open_sink
+import pipeline
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+TOLERANCE = 0.25  # slower/faster than the baseline by more than this share is reported
+ROWS_PER_PAGE = 20
+
+
+def tesseract_available() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def stub_ocr():
+    """
+    Without Tesseract, OCR still decodes the image (that cost stays in the
+    timings) but returns no text
+    """
+    def image_to_string(image, lang=None, **kwargs):
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        image.load()
+        return ''
+    pytesseract.image_to_string = image_to_string
+
+
+def timed(func, repeat: int = 1) -> float:
+    """Best wall time of func() over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def rendered_images(pdf_path: str, output_dir: str, dpi: int) -> list:
+    """Pages of the PDF rendered to JPEG (input of the image stages, not timed)"""
+    os.makedirs(output_dir, exist_ok=True)
+    with fitz.open(pdf_path) as doc:
+        paths = []
+        for page in doc:
+            path = os.path.join(output_dir, f"page_{page.number + 1}.jpg")
+            page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72)).save(path, jpg_quality=95)
+            paths.append(path)
+    return paths
+
+
+def run_case(work_dir: str, pages: int, dpi: int, repeat: int, seed: int) -> dict:
+    """Time every stage for one page count and DPI. Returns key -> result"""
+    results = {}
+
+    def record(stage, kind, items, seconds):
+        key = f"{stage}/{kind}/{pages}p/{dpi}dpi"
+        results[key] = {'seconds': round(seconds, 4), 'items': items,
+                        'items_per_second': round(items / seconds, 3) if seconds else None}
+        print(f"{key:45s} {seconds:9.3f}s  {items / seconds if seconds else 0:8.2f} items/s")
+
+    pdfs = {}
+    for kind in KINDS:
+        pdf_dir = os.path.join(work_dir, 'pdfs', f"{pages}p", kind)
+        pdfs[kind] = make_pdf(os.path.join(pdf_dir, f"{kind}.pdf"), kind, pages, seed)
+
+    # Rendu (FastPDFExtractor via batch_process_pdfs, sans manifeste)
+    for kind, pdf_path in pdfs.items():
+        output_dir = os.path.join(work_dir, 'render', kind)
+        def render():
+            shutil.rmtree(output_dir, ignore_errors=True)
+            batch_process_pdfs(os.path.dirname(pdf_path), output_dir, dpi=dpi, incremental=False)
+            # batch_process_pdfs logs the errors of a PDF and goes on: a broken render would look fast
+            rendered = [name for _, _, files in os.walk(output_dir) for name in files if name.startswith('page_')]
+            if len(rendered) != pages:
+                raise RuntimeError(f"{len(rendered)} pages rendered out of {pages} for {kind}")
+        record('render', kind, pages, timed(render, repeat))
+
+    images = {kind: rendered_images(pdf_path, os.path.join(work_dir, 'images', kind), dpi)
+              for kind, pdf_path in pdfs.items()}
+
+    # Détection et découpe des pages doubles
+    splitter = ImageSplitter('', '')
+    def detect():
+        for path in images['double_image']:
+            with Image.open(path) as image:
+                splitter.detect_split_point(image)
+    record('detect', 'double_image', pages, timed(detect, repeat))
+
+    split_dir = os.path.join(work_dir, 'split')
+    def split():
+        for _, _, _, error in split_files([(path, split_dir) for path in images['double_image']]):
+            if error is not None:
+                raise RuntimeError(error)
+    record('split', 'double_image', pages, timed(split, repeat))
+
+    # Recadrage des images sans texte
+    extractor = ImageContentExtractor()
+    crop_dir = os.path.join(work_dir, 'crop')
+    os.makedirs(crop_dir, exist_ok=True)
+    def crop():
+        for path in images['single_image']:
+            extractor.extract_image_content(path, crop_dir)
+    record('crop', 'single_image', pages, timed(crop, repeat))
+
+    # OCR (stub sans Tesseract) et écriture du classeur
+    def ocr():
+        for path in images['text']:
+            with Image.open(path) as image:
+                ocr_image(image)
+    record('ocr', 'text', pages, timed(ocr, repeat))
+
+    rows = pages * ROWS_PER_PAGE
+    def write():
+        with open_sink(os.path.join(work_dir, 'rows.xlsx')) as sink:
+            for row in range(rows):
+                sink.write_row(make_row('document', str(row // ROWS_PER_PAGE + 1), '', f"page_{row}.jpg",
+                                        'texte ' * 40, f"output_images/page_{row}.jpg", 'une_image_page'))
+    record('write', 'xlsx', rows, timed(write, repeat))
+
+    # Chaîne complète en une passe (pipeline.py), toutes les sortes de pages
+    def end_to_end():
+        output_dir = os.path.join(work_dir, 'pipeline')
+        shutil.rmtree(output_dir, ignore_errors=True)
+        with open_sink(os.path.join(work_dir, 'pipeline.jsonl')) as sink:
+            for pdf_path in pdfs.values():
+                pipeline.run_pipeline(pdf_path, output_dir, dpi=dpi, split='auto', sink=sink)
+    record('end_to_end', 'all', pages * len(pdfs), timed(end_to_end, repeat))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """
+    (key, ratio, status) for every result also in the baseline, ratio being
+    the time over the baseline time and status 'slower', 'faster' or 'same'
+    """
+    comparison = []
+    for key, result in results.items():
+        base = baseline.get('results', {}).get(key)
+        if not base or not base['seconds']:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        status = 'slower' if ratio > 1 + tolerance else 'faster' if ratio < 1 - tolerance else 'same'
+        comparison.append((key, round(ratio, 3), status))
+    return comparison
+
+
+def environment(ocr_stubbed: bool) -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pymupdf': fitz.VersionBind,
+        'ocr_stubbed': ocr_stubbed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the extraction stages on synthetic PDFs")
+    parser.add_argument('--pages', type=int, nargs='+', default=[4, 16], help="page counts per PDF")
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 300])
+    parser.add_argument('--repeat', type=int, default=1, help="runs per measure, the best one is kept")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--keep', help="keep the generated files in this folder")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    ocr_stubbed = not tesseract_available()
+    if ocr_stubbed:
+        print("Tesseract not found, OCR is stubbed (decode only)")
+        stub_ocr()
+
+    results = {}
+    work_root = args.keep or tempfile.mkdtemp(prefix='pdf2data_bench_')
+    try:
+        for pages in args.pages:
+            for dpi in args.dpi:
+                work_dir = os.path.join(work_root, f"{pages}p_{dpi}dpi")
+                results.update(run_case(work_dir, pages, dpi, args.repeat, args.seed))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    report = {'environment': environment(ocr_stubbed), 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Results saved: {args.output}")
+
+    regressions = []
+    if not os.path.exists(args.baseline) and not args.save_baseline:
+        # Pas de référence livrée : elle dépend de la machine
+        print(f"No baseline at {args.baseline}, run once with --save-baseline to compare the next runs")
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('ocr_stubbed') != ocr_stubbed:
+            print("Warning: the baseline was measured with a different OCR setup")
+        for key, ratio, status in compare(results, baseline, args.tolerance):
+            print(f"{key:45s} x{ratio:<6} {status}")
+            if status == 'slower':
+                regressions.append(key)
+        print(f"{len(regressions)} stage(s) slower than the baseline")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline saved: {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
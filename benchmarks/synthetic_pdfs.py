@@ -0,0 +1,109 @@
+#synthetic PDF corpora for the benchmarks, generated offline with PyMuPDF (same seed -> same files)
+import io
+import os
+import argparse
+import fitz
+import numpy as np
+from PIL import Image
+
+KINDS = ('single_image', 'double_image', 'plans', 'text')
+A4 = fitz.paper_rect('a4')
+A1 = fitz.paper_rect('a1')
+
+WORDS = ("le la les de des du un une et en au aux pour par sur dans avec plan façade toiture mur pierre "
+         "bois chantier restauration église maison rue place vue nord sud est ouest photographie archive "
+         "document relevé coupe élévation détail état ancien travaux année service commune").split()
+
+
+def photo(rng, width: int = 900, height: int = 600) -> bytes:
+    """JPEG of a smooth gradient with noise, compresses like a photo (not like pure noise)"""
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    image = np.clip(base * rng.uniform(0.4, 0.9) + rng.normal(0, 12, base.shape), 0, 230).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def sentence(rng, words: int) -> str:
+    return ' '.join(rng.choice(WORDS, words)).capitalize() + '.'
+
+
+def add_single_image_page(doc, rng):
+    page = doc.new_page(width=A4.width, height=A4.height)
+    page.insert_image(fitz.Rect(60, 100, 535, 560), stream=photo(rng))
+    page.insert_textbox(fitz.Rect(60, 580, 535, 700), sentence(rng, 30), fontsize=10)
+
+
+def add_double_image_page(doc, rng):
+    page = doc.new_page(width=A4.width, height=A4.height)
+    page.insert_image(fitz.Rect(60, 60, 535, 380), stream=photo(rng))
+    page.insert_image(fitz.Rect(60, 450, 535, 770), stream=photo(rng))
+    page.insert_text((60, 410), sentence(rng, 10), fontsize=9)
+    page.insert_text((60, 800), sentence(rng, 10), fontsize=9)
+
+
+def add_plans_page(doc, rng, lines: int = 600):
+    """Large-format vector drawing (A1): grid, random walls and labels"""
+    page = doc.new_page(width=A1.width, height=A1.height)
+    shape = page.new_shape()
+    for x in range(50, int(A1.width) - 50, 100):
+        shape.draw_line((x, 50), (x, A1.height - 50))
+    for y in range(50, int(A1.height) - 50, 100):
+        shape.draw_line((50, y), (A1.width - 50, y))
+    shape.finish(color=(0.7, 0.7, 0.7), width=0.3)
+    for _ in range(lines):
+        x0, y0 = rng.uniform(60, A1.width - 60), rng.uniform(60, A1.height - 60)
+        horizontal = rng.random() < 0.5
+        length = rng.uniform(20, 400)
+        shape.draw_line((x0, y0), (min(A1.width - 60, x0 + length), y0) if horizontal
+                        else (x0, min(A1.height - 60, y0 + length)))
+    shape.finish(color=(0, 0, 0), width=1.2)
+    shape.commit()
+    for _ in range(30):
+        page.insert_text((rng.uniform(60, A1.width - 300), rng.uniform(60, A1.height - 60)),
+                         sentence(rng, 3), fontsize=14)
+
+
+def add_text_page(doc, rng):
+    page = doc.new_page(width=A4.width, height=A4.height)
+    text = '\n\n'.join(' '.join(sentence(rng, int(rng.integers(8, 20))) for _ in range(6)) for _ in range(5))
+    page.insert_textbox(fitz.Rect(60, 60, 535, 780), text, fontsize=10)
+
+
+PAGE_MAKERS = {
+    'single_image': add_single_image_page,
+    'double_image': add_double_image_page,
+    'plans': add_plans_page,
+    'text': add_text_page,
+}
+
+
+def make_pdf(pdf_path: str, kind: str, pages: int, seed: int = 0) -> str:
+    """Write a PDF of `pages` pages of one kind"""
+    if kind not in PAGE_MAKERS:
+        raise ValueError(f"Unknown kind '{kind}', expected one of {', '.join(KINDS)}")
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        PAGE_MAKERS[kind](doc, rng)
+    os.makedirs(os.path.dirname(pdf_path) or '.', exist_ok=True)
+    doc.save(pdf_path, garbage=3, deflate=True)
+    doc.close()
+    return pdf_path
+
+
+def make_corpus(output_dir: str, pages: int, kinds=KINDS, seed: int = 0) -> dict:
+    """One PDF per kind in output_dir, named <kind>.pdf. Returns kind -> path"""
+    return {kind: make_pdf(os.path.join(output_dir, f"{kind}.pdf"), kind, pages, seed)
+            for kind in kinds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic PDF corpus of the benchmarks")
+    parser.add_argument('output_dir', nargs='?', default='benchmark_pdfs')
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for kind, path in make_corpus(args.output_dir, args.pages, seed=args.seed).items():
+        print(f"{kind}: {path}")
@@ -0,0 +1,128 @@
+#render pages within a memory budget: lower DPI or horizontal bands streamed to a PNG file
+import fitz
+import os
+import math
+import struct
+import zlib
+from PIL import Image
+
+from instrumentation import timer
+from manifest import atomic_output
+
+BAND_BYTES = 32 * 1024 * 1024  # size of one band when a page is rendered in bands
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IMAGE_FORMATS = ('png', 'jpg', 'webp')
+
+
+def pixmap_size(rect, dpi: int) -> tuple:
+    """(width, height) in pixels of the page rendered at dpi"""
+    zoom = dpi / 72
+    return math.ceil(rect.width * zoom), math.ceil(rect.height * zoom)
+
+
+def estimate_pixmap_bytes(rect, dpi: int, n: int = 3) -> int:
+    """Memory needed by the RGB pixmap of the page, known before rendering"""
+    width, height = pixmap_size(rect, dpi)
+    return width * height * n
+
+
+def page_budget(max_page_pixels: int = None, max_page_bytes: int = None):
+    """Per-page byte budget from a pixel and/or byte budget (None: no limit)"""
+    budgets = [budget for budget in (max_page_pixels and max_page_pixels * 3, max_page_bytes) if budget]
+    return min(budgets) if budgets else None
+
+
+def fit_dpi(rect, dpi: int, max_bytes: int, n: int = 3) -> int:
+    """Highest DPI (at most dpi) whose pixmap fits in max_bytes"""
+    needed = estimate_pixmap_bytes(rect, dpi, n)
+    if needed <= max_bytes:
+        return dpi
+    return max(1, int(dpi * math.sqrt(max_bytes / needed)))
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def render_in_bands(page, output_path: str, dpi: int, band_bytes: int = BAND_BYTES) -> tuple:
+    """
+    Render the page as horizontal bands (clip rects) and stream them into one PNG
+    file, so that only one band is in memory at a time. Returns (width, height)
+    """
+    zoom = dpi / 72
+    matrix = fitz.Matrix(zoom, zoom)
+    rect = page.rect
+    width, height = pixmap_size(rect, dpi)
+    row_bytes = width * 3
+    band_rows = max(1, band_bytes // row_bytes)
+
+    compressor = zlib.compressobj(6)
+    with atomic_output(output_path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        for top in range(0, height, band_rows):
+            bottom = min(height, top + band_rows)
+            clip = fitz.Rect(rect.x0, rect.y0 + top / zoom, rect.x1, rect.y0 + bottom / zoom)
+            pix = page.get_pixmap(matrix=matrix, clip=clip, alpha=False, colorspace=fitz.csRGB)
+            samples = pix.samples
+            stride = pix.stride
+            pix_width = min(pix.width, width) * 3
+
+            # Each PNG scanline starts with its filter type (0: none); rounding of the
+            # clip can give one row or column more or less, pad with white
+            rows = []
+            for row in range(bottom - top):
+                if row < pix.height:
+                    line = samples[row * stride: row * stride + pix_width]
+                    rows.append(b'\x00' + line + b'\xff' * (row_bytes - len(line)))
+                else:
+                    rows.append(b'\x00' + b'\xff' * row_bytes)
+            data = compressor.compress(b''.join(rows))
+            if data:
+                f.write(_png_chunk(b'IDAT', data))
+            del pix, samples, rows
+        f.write(_png_chunk(b'IDAT', compressor.flush()))
+        f.write(_png_chunk(b'IEND', b''))
+    return width, height
+
+
+def save_pixmap(pix, output_path: str, quality: int = 95):
+    """
+    Save the pixmap in the format of the output_path extension. JPEG is encoded
+    by PyMuPDF, WebP by Pillow over the pixmap buffer (no copy of the samples).
+    The file appears under its name only once complete
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    with atomic_output(output_path) as tmp_path:
+        if ext in ('.jpg', '.jpeg'):
+            pix.save(tmp_path, output='jpeg', jpg_quality=quality)
+        elif ext == '.webp':
+            mode = 'RGB' if pix.n == 3 else 'L'
+            image = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, 'raw', mode, pix.stride, 1)
+            image.save(tmp_path, 'WEBP', quality=quality)
+        else:
+            pix.save(tmp_path, output='png')
+
+
+def render_page_bounded(page, output_path: str, dpi: int, max_page_bytes: int = None,
+                        oversize: str = 'bands', quality: int = 95):
+    """
+    Render the page to output_path (PNG, JPEG or WebP from its extension). When
+    its pixmap would exceed max_page_bytes, either lower the DPI
+    (oversize='reduce_dpi') or render it in bands streamed to disk at the
+    requested DPI (oversize='bands', always written as PNG).
+    Returns (output path, width, height, dpi used)
+    """
+    if max_page_bytes and estimate_pixmap_bytes(page.rect, dpi) > max_page_bytes:
+        if oversize == 'bands':
+            output_path = os.path.splitext(output_path)[0] + '.png'
+            with timer('render'):
+                width, height = render_in_bands(page, output_path, dpi, min(BAND_BYTES, max_page_bytes))
+            return output_path, width, height, dpi
+        dpi = fit_dpi(page.rect, dpi, max_page_bytes)
+
+    with timer('render'):
+        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
+    with timer('encode'):
+        save_pixmap(pix, output_path, quality)
+    return output_path, pix.width, pix.height, dpi
@@ -1,20 +1,140 @@
 import os
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
-def convert_png_to_jpg(src_root, dst_root):
-    for root, dirs, files in os.walk(src_root):
-        print(f"Processing directory: {root}")
-        for file in files:
-            if file.lower().endswith('.png'):
-                src_file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(root, src_root)
-                dst_dir = os.path.join(dst_root, relative_path)
-                os.makedirs(dst_dir, exist_ok=True)
-                dst_file_path = os.path.join(dst_dir, os.path.splitext(file)[0] + '.jpg')
-                
-                with Image.open(src_file_path) as img:
-                    rgb_img = img.convert('RGB')
-                    rgb_img.save(dst_file_path, 'JPEG')
+from manifest import Manifest, atomic_output
+from fs_index import add_outputs, get_index
+from instrumentation import collect, count, metrics, timer, with_metrics
 
-# Example usage
-convert_png_to_jpg('extracted_pages', 'output_images')
+CONVERTED_EXTENSIONS = ('.png', '.webp')
+
+def convert_file(src_file_path, dst_file_path, quality=None):
+    """PNG/WebP -> JPEG, JPEG files (mode 'embedded') are copied as they are"""
+    with atomic_output(dst_file_path) as tmp_path:
+        if src_file_path.lower().endswith(('.jpg', '.jpeg')):
+            shutil.copy2(src_file_path, tmp_path)
+            return
+        with Image.open(src_file_path) as img:
+            # Pas de copie supplémentaire quand l'image est déjà en RGB (cas des pages rendues)
+            rgb_img = img if img.mode == 'RGB' else img.convert('RGB')
+            options = {} if quality is None else {'quality': quality}
+            rgb_img.save(tmp_path, 'JPEG', **options)
+
+def convert_task(args):
+    """
+    Worker task: convert one file. Errors are returned instead of raised so
+    that one bad file does not stop the others. Returns (dst_file_path, error)
+    """
+    src_file_path, dst_file_path, quality = args
+    try:
+        with timer('convert'):
+            convert_file(src_file_path, dst_file_path, quality)
+        count('images')
+        return dst_file_path, None
+    except Exception as e:
+        return dst_file_path, str(e)
+
+def claim_destination(sources, src_file_path, dst_file_path):
+    """
+    Reserve dst_file_path for src_file_path. Two sources with the same name
+    and another extension (page_1.png, page_1.webp, page_1.jpg) give the same
+    JPEG: only the first one is kept, the others are logged and skipped
+    """
+    other = sources.setdefault(dst_file_path, src_file_path)
+    if other != src_file_path:
+        print(f"Skipping {src_file_path}: {dst_file_path} already comes from {other}")
+        count('collisions')
+        return False
+    return True
+
+def convert_png_to_jpg(src_root, dst_root, incremental=True, parallel=True, max_workers=None, quality=None,
+                       report_file=None):
+    """
+    Convert the PNG (and WebP) files of src_root to JPEG in dst_root, with the same
+    folders, and copy the JPEG files. Files already converted from the same
+    content (see the manifest) are skipped, the others are converted in a
+    process pool when parallel. quality=None keeps the Pillow default.
+    report_file: JSON run report, see instrumentation
+    """
+    metrics.reset()
+    # Les PNG déjà convertis (même contenu) sont ignorés grâce au manifeste
+    manifest = Manifest.for_directory(dst_root)
+    params = {'format': 'JPEG'}
+    if quality is not None:
+        params['quality'] = quality
+    try:
+        tasks = []
+        pending = {}
+        # Fichier source de chaque JPEG : page_1.png et page_1.webp donneraient tous deux page_1.jpg
+        sources = {}
+        for root, dirs, files in get_index(src_root).walk(src_root):
+            print(f"Processing directory: {root}")
+            for file in sorted(files):
+                if file.lower().endswith(CONVERTED_EXTENSIONS):
+                    src_file_path = os.path.join(root, file)
+                    relative_path = os.path.relpath(root, src_root)
+                    dst_dir = os.path.join(dst_root, relative_path)
+                    os.makedirs(dst_dir, exist_ok=True)
+                    dst_file_path = os.path.join(dst_dir, os.path.splitext(file)[0] + '.jpg')
+                    if not claim_destination(sources, src_file_path, dst_file_path):
+                        continue
+                    
+                    src_hash = manifest.file_hash(src_file_path)
+                    if incremental and manifest.is_done('convert', dst_file_path, src_hash, params):
+                        continue
+                    
+                    tasks.append((src_file_path, dst_file_path, quality))
+                    pending[dst_file_path] = ('convert', src_hash, params)
+                elif file.lower().endswith(('.jpg', '.jpeg')):
+                    # Images extraites telles quelles du PDF (mode 'embedded') : simple copie
+                    src_file_path = os.path.join(root, file)
+                    dst_dir = os.path.join(dst_root, os.path.relpath(root, src_root))
+                    os.makedirs(dst_dir, exist_ok=True)
+                    dst_file_path = os.path.join(dst_dir, file)
+                    if not claim_destination(sources, src_file_path, dst_file_path):
+                        continue
+                    
+                    src_hash = manifest.file_hash(src_file_path)
+                    if incremental and manifest.is_done('copy', dst_file_path, src_hash):
+                        continue
+                    tasks.append((src_file_path, dst_file_path, None))
+                    pending[dst_file_path] = ('copy', src_hash, None)
+        
+        if not tasks:
+            print("All images are up to date")
+            return
+        
+        if max_workers is None:
+            max_workers = max(1, multiprocessing.cpu_count() - 1)  # Leave one CPU core free
+        max_workers = max(1, min(max_workers, len(tasks)))
+        print(f"Converting {len(tasks)} images using {max_workers if parallel else 1} processes")
+        
+        if parallel and max_workers > 1:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            results = map(collect, executor.map(with_metrics, [convert_task] * len(tasks), tasks,
+                                                chunksize=max(1, min(16, len(tasks) // (max_workers * 4)))))
+        else:
+            executor = None
+            results = map(convert_task, tasks)
+        try:
+            for dst_file_path, error in results:
+                stage, src_hash, stage_params = pending[dst_file_path]
+                if error is not None:
+                    print(f"Error converting {dst_file_path}: {error}")
+                    manifest.fail(stage, dst_file_path, error)
+                    continue
+                manifest.record(stage, dst_file_path, src_hash, stage_params, [dst_file_path])
+                add_outputs([dst_file_path])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    finally:
+        manifest.save()
+        if report_file:
+            metrics.write_report(report_file, command='convert_png_to_jpg')
+
+if __name__ == "__main__":
+    # Example usage
+    convert_png_to_jpg('extracted_pages', 'output_images')
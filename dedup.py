@@ -0,0 +1,73 @@
+#content-addressed deduplication: identical pages and images, in any document, are processed once
+import os
+import shutil
+import hashlib
+
+from manifest import atomic_output, file_digest
+
+
+def _stream_digest(doc, xref: int, cache: dict) -> str:
+    """Digest of a raw (still compressed) stream, shared objects are read once per document"""
+    if xref not in cache:
+        cache[xref] = hashlib.sha1(doc.xref_stream_raw(xref) or b'').hexdigest() if xref else ''
+    return cache[xref]
+
+
+def page_digest(doc, page, cache: dict = None) -> str:
+    """
+    Digest of what the page draws: its boxes and rotation, its content stream,
+    the streams of its images, forms and fonts and its annotations. Two pages
+    with the same digest render the same, whatever their document. Only the PDF
+    objects are read, nothing is rendered or decoded. cache (xref -> digest)
+    avoids reading the images and fonts shared by the pages of a document again
+    """
+    if cache is None:
+        cache = {}
+    digest = hashlib.sha1()
+    digest.update(repr((tuple(round(v, 2) for v in page.rect), tuple(round(v, 2) for v in page.cropbox),
+                        page.rotation)).encode())
+    digest.update(page.read_contents())
+    for xref, smask, *_, name, _, _ in sorted(page.get_images(full=True), key=lambda image: image[7]):
+        digest.update(f"image {name} {_stream_digest(doc, xref, cache)} {_stream_digest(doc, smask, cache)}".encode())
+    for xref, name, *_ in sorted(page.get_xobjects(), key=lambda xobject: xobject[1]):
+        digest.update(f"form {name} {_stream_digest(doc, xref, cache)}".encode())
+    for xref, _, font_type, basefont, name, encoding, *_ in sorted(page.get_fonts(full=True), key=lambda font: font[4]):
+        if ('font', xref) not in cache:
+            font = doc.extract_font(xref)
+            cache[('font', xref)] = hashlib.sha1(font[-1] or b'').hexdigest() if font else ''
+        digest.update(f"font {name} {basefont} {font_type} {encoding} {cache[('font', xref)]}".encode())
+    for annot in page.annots():
+        digest.update(doc.xref_object(annot.xref, compressed=True).encode())
+    return digest.hexdigest()
+
+
+def image_digest(file_path: str) -> str:
+    """
+    Key of an image file: the digest of its bytes. Pages rendered from the
+    same content give the same bytes, so duplicates keep matching down the chain
+    """
+    return file_digest(file_path)
+
+
+def renamed(path: str, source_stem: str, target_stem: str, output_dir: str) -> str:
+    """page_3_top.jpg produced for page_3 -> output_dir/page_8_top.jpg for page_8"""
+    name = os.path.basename(path)
+    if name.startswith(source_stem):
+        name = target_stem + name[len(source_stem):]
+    return os.path.join(output_dir, name)
+
+
+def copy_outputs(outputs: list, source_stem: str, target_stem: str, output_dir: str) -> dict:
+    """
+    Give a duplicate its own copy of the outputs of the first occurrence, renamed
+    after the duplicate (see renamed). Returns source path -> copy path
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    copies = {}
+    for path in outputs:
+        target = renamed(path, source_stem, target_stem, output_dir)
+        if os.path.abspath(target) != os.path.abspath(path):
+            with atomic_output(target) as tmp_path:
+                shutil.copyfile(path, tmp_path)
+        copies[path] = target
+    return copies
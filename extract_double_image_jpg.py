@@ -2,11 +2,151 @@ import fitz
 import os
 from pathlib import Path
 import logging
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import multiprocessing
 from PIL import Image
 import numpy as np
 
+from manifest import Manifest, atomic_output
+from dedup import copy_outputs
+from fs_index import add_outputs, get_index
+from instrumentation import collect, count, metrics, timer, with_metrics
+from jpeg_crop import is_jpeg, lossless_crop, mcu_size, open_reduced
+
+# Parameters recorded in the manifest, a change re-splits every image
+SPLIT_PARAMS = {'method': 'whitespace_gaps', 'quality': 95, 'crop': 'lossless'}
+
+# Split detection works on a small grayscale copy of the page, never on the full 300 DPI array
+PROFILE_SIZE = 512         # side of the downscaled detection image
+BACKGROUND_TOLERANCE = 12  # max grey level difference between a gap line and the background
+GAP_VARIANCE = 60.0        # max variance of a gap line (nearly uniform)
+MIN_GAP = 0.01             # min gap thickness, fraction of the page
+MIN_PART = 0.1             # min size of each part, fraction of the page
+MIN_CONTENT = 0.15         # min share of the page content in each part
+BAND = 3                   # lines per band when looking for the middle split
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SPLIT_BATCH = 8  # images whose splits are detected together by one worker task (see split_files)
+
+def configure_logging():
+    """
+    Configure logging once per process (not once per splitter)
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def profile_images(images, size: int = PROFILE_SIZE) -> np.ndarray:
+    """
+    Stack of size x size grayscale thumbnails (float32, shape (B, size, size)).
+    Positions found on a thumbnail are scaled back to each image's own size.
+    Each image is reduced before the grayscale conversion, so no full size copy is made
+    """
+    return np.stack([
+        np.asarray(image.resize((size, size), Image.BOX, reducing_gap=2.0).convert('L'))
+        for image in images
+    ]).astype(np.float32)
+
+def line_statistics(stack: np.ndarray, axis: int):
+    """
+    Sums and sums of squares of every row (axis=0) or column (axis=1) of a
+    (B, H, W) stack, in one pass over the pixels
+    """
+    reduce_axis = 2 if axis == 0 else 1
+    return stack.sum(axis=reduce_axis), np.square(stack).sum(axis=reduce_axis)
+
+def band_variance(sums: np.ndarray, squares: np.ndarray, count: int, band: int = 1) -> np.ndarray:
+    """
+    Variance of every band of `band` consecutive lines from the per-line sums,
+    using cumulative sums so that it costs O(lines) whatever the band size
+    """
+    zeros = np.zeros(sums.shape[:-1] + (1,), dtype=np.float64)
+    cum_sums = np.concatenate((zeros, np.cumsum(sums, axis=-1, dtype=np.float64)), axis=-1)
+    cum_squares = np.concatenate((zeros, np.cumsum(squares, axis=-1, dtype=np.float64)), axis=-1)
+    n = count * band
+    mean = (cum_sums[..., band:] - cum_sums[..., :-band]) / n
+    return (cum_squares[..., band:] - cum_squares[..., :-band]) / n - mean ** 2
+
+def find_gaps(is_gap: np.ndarray, length: int, min_gap: int):
+    """
+    (start, stop) of the runs of gap lines that do not touch the page border
+    (those are margins) and are at least min_gap lines thick
+    """
+    padded = np.concatenate(([0], is_gap.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    starts, stops = edges[0::2], edges[1::2]
+    keep = (starts > 0) & (stops < length) & (stops - starts >= min_gap)
+    return starts[keep], stops[keep]
+
+def choose_splits(starts, stops, content: np.ndarray, n_splits: int = None):
+    """
+    Split lines in the middle of the widest gaps, keeping at most n_splits splits.
+    Every part must be at least MIN_PART of the page and hold at least MIN_CONTENT
+    of the page content (content: how far each line is from the background),
+    so that a gap next to a title or a caption is not taken for a split
+    """
+    length = len(content)
+    cumulative = np.concatenate(([0.0], np.cumsum(content, dtype=np.float64)))
+    min_content = MIN_CONTENT * cumulative[-1]
+    
+    def part_ok(start, stop):
+        return stop - start >= MIN_PART * length and cumulative[stop] - cumulative[start] >= min_content
+    
+    splits = []
+    for index in np.argsort(stops - starts)[::-1]:
+        if n_splits is not None and len(splits) >= n_splits:
+            break
+        center = int(starts[index] + stops[index]) // 2
+        bounds = sorted(splits + [0, length])
+        position = np.searchsorted(bounds, center)
+        if part_ok(bounds[position - 1], center) and part_ok(center, bounds[position]):
+            splits.append(center)
+    return sorted(splits)
+
+def detect_split_points_batch(images, n_splits: int = None, axis: str = 'auto'):
+    """
+    Detect the splits of a batch of pages. The line statistics of the whole batch
+    are computed with single NumPy calls on a (B, PROFILE_SIZE, PROFILE_SIZE) stack.
+    Returns one (axis, split positions) per image: axis 0 means stacked images
+    (split rows, in pixels), axis 1 side-by-side images (split columns).
+    An empty list means that no whitespace gap was found
+    """
+    size = PROFILE_SIZE
+    stack = profile_images(images, size)
+    
+    # Background: median grey level of the page border
+    border = np.concatenate((stack[:, 0, :], stack[:, -1, :], stack[:, :, 0], stack[:, :, -1]), axis=1)
+    background = np.median(border, axis=1)[:, None]
+    
+    candidates = {}
+    contents = {}
+    for split_axis in (0, 1):
+        if axis != 'auto' and axis != split_axis:
+            continue
+        sums, squares = line_statistics(stack, split_axis)
+        mean = sums / size
+        variance = squares / size - mean ** 2
+        is_gap = (variance <= GAP_VARIANCE) & (np.abs(mean - background) <= BACKGROUND_TOLERANCE)
+        candidates[split_axis] = is_gap
+        contents[split_axis] = np.abs(mean - background)
+    
+    results = []
+    min_gap = max(1, int(MIN_GAP * size))
+    for index, image in enumerate(images):
+        best = (0, [])
+        best_width = 0
+        for split_axis, is_gap in candidates.items():
+            starts, stops = find_gaps(is_gap[index], size, min_gap)
+            splits = choose_splits(starts, stops, contents[split_axis][index], n_splits)
+            width = int((stops - starts).max()) if len(starts) else 0
+            if splits and width > best_width:
+                best, best_width = (split_axis, splits), width
+        split_axis, splits = best
+        full_length = image.height if split_axis == 0 else image.width
+        results.append((split_axis, [round(split * full_length / size) for split in splits]))
+    return results
+
 class ImageSplitter:
     def __init__(self, image_path: str, output_dir: str):
         """
@@ -15,56 +155,138 @@ class ImageSplitter:
         self.image_path = image_path
         self.image_name = Path(image_path).stem
         self.output_dir = output_dir
-        
-        # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        self.split_axis = None  # axis of the last split (see split_layout)
         self.logger = logging.getLogger(__name__)
 
     def detect_split_point(self, image):
         """
         Detect the point where the image should be split by analyzing white space
-        or significant changes in pixel values
+        or significant changes in pixel values: the most uniform band of rows in
+        the middle third, found on the downscaled profile
+        """
+        stack = profile_images([image])
+        size = stack.shape[1]
+        sums, squares = line_statistics(stack, 0)
+        variances = band_variance(sums, squares, size, BAND)[0]
+        
+        # Look for horizontal band with lowest variance in middle section
+        start, stop = size // 3, 2 * size // 3 - BAND + 1
+        split_offset = int(np.argmin(variances[start:stop])) + start + BAND // 2
+        
+        return round(split_offset * image.height / size)
+
+    def detect_split_points(self, image, n_splits: int = None, axis: str = 'auto'):
+        """
+        Detect every whitespace split of the page, see detect_split_points_batch
+        """
+        return detect_split_points_batch([image], n_splits, axis)[0]
+
+    def split_layout(self, image, n_splits: int = None, layout: tuple = None):
+        """
+        (axis, split positions) of the image, falling back to the middle split
+        when no clear gap is found. layout: splits already detected in a batch
+        """
+        split_axis, splits = layout if layout is not None else self.detect_split_points(image, n_splits)
+        if not splits:
+            split_axis, splits = 0, [self.detect_split_point(image)]
+        return split_axis, splits
+
+    def detection_image(self):
         """
-        # Convert image to grayscale numpy array
-        img_array = np.array(image.convert('L'))
-        height = img_array.shape[0]
+        (image the splits are detected on, scale back to the full image): a
+        DCT-scaled decode for a JPEG, whose parts are then cut out of the file
+        (see split_jpeg_losslessly), the full image otherwise
+        """
+        with timer('decode'):
+            if is_jpeg(self.image_path):
+                return open_reduced(self.image_path, max_size=2 * PROFILE_SIZE)
+            image = Image.open(self.image_path)
+            image.load()
+            return image, (1.0, 1.0)
+
+    @staticmethod
+    def part_boxes(size, split_axis: int, splits: list):
+        """
+        (position, box) of each part: top/bottom or left/right for two parts,
+        part1..partN beyond
+        """
+        width, height = size
+        bounds = [0] + splits + [height if split_axis == 0 else width]
+        boxes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if split_axis == 0:
+                boxes.append((0, start, width, stop))
+            else:
+                boxes.append((start, 0, stop, height))
         
-        # Look for horizontal line with highest contrast in middle section
-        middle_section = img_array[height//3:2*height//3, :]
-        row_variances = np.var(middle_section, axis=1)
-        split_offset = np.argmin(row_variances) + height//3
+        if len(boxes) == 2:
+            names = ['top', 'bottom'] if split_axis == 0 else ['left', 'right']
+        else:
+            names = [f"part{index}" for index in range(1, len(boxes) + 1)]
+        return list(zip(names, boxes))
+
+    def split_image(self, image, n_splits: int = None):
+        """
+        Split an already decoded image into its parts. Returns a list of
+        (position, image), see part_boxes
+        """
+        split_axis, splits = self.split_layout(image, n_splits)
+        self.split_axis = split_axis
+        return [(name, image.crop(box)) for name, box in self.part_boxes(image.size, split_axis, splits)]
+
+    def split_jpeg_losslessly(self, split_axis: int, splits: list):
+        """
+        Split a JPEG file without decoding it at full size: the splits (full image
+        pixels, detected on a DCT-scaled decode) are moved onto the MCU grid (they
+        fall in whitespace anyway) and the parts are cut out of the compressed data
+        """
+        with Image.open(self.image_path) as image:
+            size, mcu = image.size, mcu_size(image)
+        
+        step = mcu[1 - split_axis]
+        length = size[1 - split_axis]
+        splits = sorted({min(length - 1, max(step, round(split / step) * step)) for split in splits})
         
-        return split_offset
+        output_paths = []
+        for position, box in self.part_boxes(size, split_axis, splits):
+            output_path = os.path.join(self.output_dir, f"{self.image_name}_{position}.jpg")
+            with timer('encode'):
+                lossless_crop(self.image_path, output_path, box)
+            output_paths.append(output_path)
+        return output_paths
 
-    def split_and_save_image(self):
+    def split_and_save_image(self, image=None, scale=(1.0, 1.0), layout: tuple = None):
         """
-        Split the input image into two separate images and save them
+        Split the input image into separate images and save them. image, scale
+        (see detection_image) and layout (see detect_split_points_batch) come
+        from split_files when the splits of a batch were detected together
         """
         try:
             # Create output directory if it doesn't exist
             os.makedirs(self.output_dir, exist_ok=True)
             
-            # Open the image
-            image = Image.open(self.image_path)
+            if image is None:
+                image, scale = self.detection_image()
+            with timer('split'):
+                split_axis, splits = self.split_layout(image, layout=layout)
+            self.split_axis = split_axis
             
-            # Get the split point
-            split_point = self.detect_split_point(image)
-            
-            # Split the image
-            top_image = image.crop((0, 0, image.width, split_point))
-            bottom_image = image.crop((0, split_point, image.width, image.height))
+            if is_jpeg(self.image_path):
+                splits = [round(split * scale[1 - split_axis]) for split in splits]
+                output_paths = self.split_jpeg_losslessly(split_axis, splits)
+                self.logger.info(f"Successfully split {self.image_name} into {len(output_paths)} images")
+                return output_paths
             
             # Save the split images
-            top_output_path = os.path.join(self.output_dir, f"{self.image_name}_top.jpg")
-            bottom_output_path = os.path.join(self.output_dir, f"{self.image_name}_bottom.jpg")
-            
-            top_image.save(top_output_path, quality=95)
-            bottom_image.save(bottom_output_path, quality=95)
+            output_paths = []
+            for position, box in self.part_boxes(image.size, split_axis, splits):
+                output_path = os.path.join(self.output_dir, f"{self.image_name}_{position}.jpg")
+                with timer('encode'), atomic_output(output_path) as tmp_path:
+                    image.crop(box).save(tmp_path, 'JPEG', quality=95)
+                output_paths.append(output_path)
             
-            self.logger.info(f"Successfully split {self.image_name} into two images")
+            self.logger.info(f"Successfully split {self.image_name} into {len(output_paths)} images")
+            return output_paths
             
         except Exception as e:
             self.logger.error(f"Error during image splitting: {e}")
@@ -73,14 +295,14 @@ class ImageSplitter:
 def find_doubles_images_folders(root_dir: str) -> list:
     """
     Recursively find all folders named 'doubles_images_pages' in the directory tree,
-    including those nested within other folders
+    including those nested within other folders (from the shared index, see fs_index)
     """
     doubles_images_folders = []
     target_folder_name = 'doubles_images_pages'
     
     try:
         logging.info(f"Starting search in root directory: {root_dir}")
-        for root, dirs, _ in os.walk(root_dir):
+        for root, dirs, _ in get_index(root_dir).walk(root_dir):
             logging.debug(f"Scanning directory: {root}")
             logging.debug(f"Found directories: {dirs}")
             
@@ -102,18 +324,84 @@ def find_doubles_images_folders(root_dir: str) -> list:
     
     return doubles_images_folders
 
-def process_folder(folder_path: str):
+def split_output_dir(folder_path: str) -> str:
+    """Output directory next to the doubles_images_pages folder"""
+    return os.path.join(os.path.dirname(folder_path), 'split_images')
+
+def split_files(tasks: list) -> list:
     """
-    Process all images in a single doubles_images_pages folder
+    Worker task: split a batch of (image_path, output_dir) images, their splits
+    being detected with a single detect_split_points_batch call. Errors are
+    returned instead of raised so that one bad image does not stop the others.
+    Returns one (image_path, outputs, split axis, error) per task, the axis is
+    journaled with the outputs (see split_axes)
+    """
+    results = {}
+    prepared = []
+    for image_path, output_dir in tasks:
+        splitter = ImageSplitter(image_path, output_dir)
+        try:
+            prepared.append((splitter, *splitter.detection_image()))
+        except Exception as e:
+            results[image_path] = (image_path, None, None, str(e))
+    
+    layouts = []
+    if prepared:
+        with timer('split'):
+            layouts = detect_split_points_batch([image for _, image, _ in prepared])
+    for (splitter, image, scale), layout in zip(prepared, layouts):
+        try:
+            outputs = splitter.split_and_save_image(image, scale, layout)
+            count('images', len(outputs))
+            results[splitter.image_path] = (splitter.image_path, outputs, splitter.split_axis, None)
+        except Exception as e:
+            results[splitter.image_path] = (splitter.image_path, None, None, str(e))
+    return [results[image_path] for image_path, _ in tasks]
+
+def split_file(args):
+    """Worker task: split one image, see split_files"""
+    return split_files([args])[0]
+
+def reuse_split(manifest: Manifest, image_path: str, image_hash: str, output_dir: str):
+    """
+    Copy the parts of an identical image already split, whatever its path (see
+    dedup), renamed after image_path. Returns the outputs, None when there is none
+    """
+    found = manifest.find('split', image_hash, SPLIT_PARAMS)
+    if not found:
+        return None
+    source_path, entry = found
+    copies = copy_outputs(entry['outputs'], Path(source_path).stem, Path(image_path).stem, output_dir)
+    outputs = list(copies.values())
+    manifest.record('split', image_path, image_hash, SPLIT_PARAMS, outputs, entry['data'])
+    add_outputs(outputs)
+    return outputs
+
+def split_axes(manifest: Manifest) -> dict:
+    """
+    Split axis of every part journaled in the manifest, as {absolute part path:
+    axis} (0: stacked parts, 1: side by side, see ImageSplitter.split_layout)
+    """
+    axes = {}
+    for entry in manifest.done('split').values():
+        if entry['data'].get('axis') is not None:
+            for output in entry['outputs']:
+                axes[os.path.abspath(output)] = entry['data']['axis']
+    return axes
+
+def process_folder(folder_path: str, manifest: Manifest = None, incremental: bool = True, dedup: bool = True):
+    """
+    Process all images in a single doubles_images_pages folder.
+    Images already split from the same content (see manifest) are skipped,
+    with dedup the parts of an identical image split elsewhere are copied
     """
     try:
         # Create output directory next to the input directory
-        parent_dir = os.path.dirname(folder_path)
-        output_dir = os.path.join(parent_dir, 'split_images')
+        output_dir = split_output_dir(folder_path)
         
         # Get all image files in the folder
-        image_files = [f for f in os.listdir(folder_path) 
-                      if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+        image_files = [f for f in get_index(folder_path).files(folder_path)
+                      if f.lower().endswith(IMAGE_EXTENSIONS)]
         
         if not image_files:
             print(f"No image files found in {folder_path}")
@@ -121,23 +409,112 @@ def process_folder(folder_path: str):
         
         print(f"Found {len(image_files)} image files to process in {folder_path}")
         
-        # Process each image
+        # Process each image, the splits of SPLIT_BATCH images being detected together
+        hashes = {}
+        pending = []
+        first_seen = set()
+        duplicates = []
         for image_file in image_files:
             image_path = os.path.join(folder_path, image_file)
-            print(f"Processing: {image_file}")
             
-            splitter = ImageSplitter(image_path, output_dir)
-            splitter.split_and_save_image()
+            image_hash = hashes[image_path] = manifest.file_hash(image_path) if manifest else None
+            if manifest and incremental and manifest.is_done('split', image_path, image_hash, SPLIT_PARAMS):
+                print(f"Unchanged, skipped: {image_file}")
+                continue
+            if manifest and incremental and dedup and reuse_split(manifest, image_path, image_hash, output_dir):
+                print(f"Identical image already split, copied: {image_file}")
+                continue
+            if manifest and dedup:
+                # Même contenu qu'une image de ce dossier pas encore découpée : copiée après elle
+                if image_hash in first_seen:
+                    duplicates.append(image_path)
+                    continue
+                first_seen.add(image_hash)
+            pending.append((image_path, output_dir))
+        
+        for start in range(0, len(pending), SPLIT_BATCH):
+            print(f"Processing: {', '.join(os.path.basename(path) for path, _ in pending[start:start + SPLIT_BATCH])}")
+            for image_path, outputs, split_axis, error in split_files(pending[start:start + SPLIT_BATCH]):
+                if error is not None:
+                    print(f"Error processing {os.path.basename(image_path)}: {error}")
+                    if manifest:
+                        manifest.fail('split', image_path, error)
+                    continue
+                if manifest:
+                    manifest.record('split', image_path, hashes[image_path], SPLIT_PARAMS, outputs,
+                                    {'axis': split_axis})
+                add_outputs(outputs)
+        for image_path in duplicates:
+            if reuse_split(manifest, image_path, hashes[image_path], output_dir):
+                print(f"Identical image already split, copied: {os.path.basename(image_path)}")
+            else:
+                print(f"Error processing {os.path.basename(image_path)}: its identical image failed")
             
         print(f"Completed processing folder: {folder_path}")
         
     except Exception as e:
         print(f"Error processing folder {folder_path}: {e}")
 
-def batch_process_directories(root_dir: str = "."):
+def split_images_parallel(tasks: list, manifest: Manifest = None, hashes: dict = None,
+                          max_workers: int = None, max_inflight: int = None):
+    """
+    Split (image_path, output_dir) tasks from every folder with one process pool,
+    in batches of up to SPLIT_BATCH images per worker task (see split_files).
+    At most max_inflight images are submitted at once to keep memory bounded.
+    Returns the list of (image_path, error) that failed
+    """
+    if max_workers is None:
+        max_workers = max(1, multiprocessing.cpu_count() - 1)  # Leave one CPU core free
+    max_workers = max(1, min(max_workers, len(tasks)))
+    if max_inflight is None:
+        max_inflight = max_workers * 4
+    # Smaller batches when there are few images, so that every worker gets some
+    batch_size = max(1, min(SPLIT_BATCH, -(-len(tasks) // max_workers)))
+    batches = [tasks[start:start + batch_size] for start in range(0, len(tasks), batch_size)]
+    max_batches = max(1, max_inflight // batch_size)
+    
+    failures = []
+    done = 0
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=configure_logging) as executor:
+        in_flight = set()
+        next_batch = 0
+        while next_batch < len(batches) or in_flight:
+            while next_batch < len(batches) and len(in_flight) < max_batches:
+                in_flight.add(executor.submit(with_metrics, split_files, batches[next_batch]))
+                next_batch += 1
+            
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for image_path, outputs, split_axis, error in collect(future.result()):
+                    done += 1
+                    if error is not None:
+                        print(f"Error processing {image_path}: {error}")
+                        failures.append((image_path, error))
+                        if manifest:
+                            manifest.fail('split', image_path, error)
+                        continue
+                    if manifest:
+                        manifest.record('split', image_path, hashes[image_path], SPLIT_PARAMS, outputs,
+                                        {'axis': split_axis})
+                    add_outputs(outputs)
+                    print(f"Split {os.path.basename(image_path)} ({done}/{len(tasks)})")
+    return failures
+
+def batch_process_directories(root_dir: str = "output_images", incremental: bool = True, parallel: bool = True,
+                              max_workers: int = None, max_inflight: int = None, dedup: bool = True,
+                              report_file: str = None):
     """
-    Find and process all doubles_images_pages folders in the directory tree
+    Find and process all doubles_images_pages folders in the directory tree.
+    The split axes are journaled in the manifest of root_dir, the one
+    extract_text_from_images reads them from (its split_root).
+    With parallel, the images of all folders are spread over one worker pool.
+    With dedup, an image identical to one already split (same bytes, in any
+    folder) is not split again, the parts of the first one are copied.
+    report_file: JSON run report, see instrumentation
     """
+    metrics.reset()
+    configure_logging()
+    manifest = Manifest.for_directory(root_dir)
     try:
         # Find all doubles_images_pages folders
         doubles_images_folders = find_doubles_images_folders(root_dir)
@@ -148,18 +525,58 @@ def batch_process_directories(root_dir: str = "."):
         
         print(f"Found {len(doubles_images_folders)} 'doubles_images_pages' folders to process")
         
+        if parallel:
+            # Images of every folder, except those already split from the same content
+            tasks = []
+            hashes = {}
+            first_seen = set()
+            duplicates = []
+            reused = 0
+            for folder in doubles_images_folders:
+                output_dir = split_output_dir(folder)
+                for image_file in get_index(folder).files(folder):
+                    if not image_file.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    image_path = os.path.join(folder, image_file)
+                    hashes[image_path] = manifest.file_hash(image_path)
+                    if incremental and manifest.is_done('split', image_path, hashes[image_path], SPLIT_PARAMS):
+                        continue
+                    if dedup:
+                        # Même contenu qu'une image déjà découpée (lancement précédent ou plus tôt dans celui-ci)
+                        if incremental and reuse_split(manifest, image_path, hashes[image_path], output_dir):
+                            reused += 1
+                            continue
+                        if hashes[image_path] in first_seen:
+                            duplicates.append((image_path, output_dir))
+                            continue
+                        first_seen.add(hashes[image_path])
+                    tasks.append((image_path, output_dir))
+            
+            print(f"Found {len(tasks)} images to split, {reused + len(duplicates)} identical to another one")
+            failures = split_images_parallel(tasks, manifest, hashes, max_workers, max_inflight) if tasks else []
+            for image_path, output_dir in duplicates:
+                if not reuse_split(manifest, image_path, hashes[image_path], output_dir):
+                    failures.append((image_path, "its identical image failed"))
+            total = len(tasks) + len(duplicates)
+            print(f"\nAll folders processed: {total - len(failures)}/{total} images split")
+            return
+        
         # Process each folder
         for folder in doubles_images_folders:
             print(f"\nProcessing folder: {folder}")
-            process_folder(folder)
+            process_folder(folder, manifest, incremental, dedup)
             
         print("\nAll folders processed successfully")
         
     except Exception as e:
         print(f"Error in batch processing: {e}")
+    finally:
+        manifest.save()
+        if report_file:
+            metrics.write_report(report_file, command='batch_process_directories', root_dir=root_dir)
 
 if __name__ == "__main__":
     # You can specify a different root directory as an argument
     import sys
-    root_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    root_dir = sys.argv[1] if len(sys.argv) > 1 else "output_images"
     batch_process_directories(root_dir)
\ No newline at end of file
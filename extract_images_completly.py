@@ -1,27 +1,73 @@
 import cv2
 import numpy as np
-import os
 from pathlib import Path
 import logging
+from PIL import Image
+
+from manifest import Manifest, atomic_output
+from dedup import copy_outputs
+from fs_index import add_outputs, get_index
+from jpeg_crop import is_jpeg, lossless_crop
+from instrumentation import count, metrics, timer
+
+SEGMENT_SIZE = 1024  # longest side of the mask the regions are searched on
+MERGE_GAP = 0.02  # regions closer than this share of the image are merged
+
+def merge_boxes(boxes, gap):
+    """
+    Merge the (x, y, w, h) boxes that overlap or are less than gap pixels apart,
+    until no two boxes are that close. Returned in reading order (top, then left)
+    """
+    boxes = [(x, y, x + w, y + h) for x, y, w, h in boxes]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if (box[0] <= other[2] + gap and other[0] <= box[2] + gap
+                        and box[1] <= other[3] + gap and other[1] <= box[3] + gap):
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in sorted(boxes, key=lambda box: (box[1], box[0]))]
 
 class ImageContentExtractor:
-    def __init__(self, base_output_dir: str = "output_images"):
+    def __init__(self, base_output_dir: str = "output_images", log_file: str = None):
+        """
+        log_file: also write the log to this file (the script uses image_extraction.log),
+        workers and library users only get the usual logging
+        """
         self.base_output_dir = base_output_dir
-        self.min_area = 5000  # Minimum area for image content
+        self.min_area = 5000  # Minimum area for image content (pixels of the full image)
+        self.threshold = 240  # Pixels brighter than this are background
+        self.padding = 10  # Margin kept around the content
         self.subfolder_name = "image_sans_texte"
         
+        handlers = [logging.StreamHandler()]
+        if log_file:
+            handlers.insert(0, logging.FileHandler(log_file, encoding='utf-8'))
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[logging.FileHandler('image_extraction.log', encoding='utf-8'), 
-                     logging.StreamHandler()]
+            handlers=handlers
         )
         self.logger = logging.getLogger(__name__)
 
+    @property
+    def params(self):
+        """Parameters recorded in the manifest, a change re-extracts every image"""
+        return {'threshold': self.threshold, 'padding': self.padding, 'min_area': self.min_area,
+                'crop': 'lossless', 'regions': 'all'}
+
     def find_image_folders(self):
-        """Find all 'split_images' and 'une_image_page' folders recursively"""
+        """Find all 'split_images' and 'une_image_page' folders recursively (shared index, see fs_index)"""
         target_folders = []
-        for root, dirs, _ in os.walk(str(Path(self.base_output_dir))):
+        for root, dirs, _ in get_index(self.base_output_dir).walk(str(Path(self.base_output_dir))):
             if 'split_images' in dirs:
                 target_folders.append(str(Path(root) / 'split_images'))
             if 'une_image_page' in dirs:
@@ -30,9 +76,8 @@ class ImageContentExtractor:
 
     def find_jpg_files(self, folder_path):
         """Find all jpg files containing 'page' in the filename"""
-        folder_path = Path(folder_path)
-        return [f.name for f in folder_path.glob('*.jpg') 
-                if 'page' in f.name.lower()]
+        return [name for name in get_index(folder_path).files(folder_path)
+                if name.endswith('.jpg') and 'page' in name.lower()]
 
     def create_extraction_subfolder(self, source_folder: str) -> str:
         """Create image_sans_texte subfolder in the source directory"""
@@ -40,56 +85,171 @@ class ImageContentExtractor:
         subfolder_path.mkdir(exist_ok=True)
         return str(subfolder_path)
 
+    @staticmethod
+    def region_path(output_folder, image_path, index: int, count: int):
+        """Same file name for a single region, <name>_regionK for several"""
+        if count == 1:
+            return output_folder / image_path.name
+        return output_folder / f"{image_path.stem}_region{index}{image_path.suffix}"
+
     def extract_image_content(self, image_path: str, output_folder: str):
+        """
+        Save every image region of the file (see segment_regions) in output_folder.
+        Returns one dict per region with the output file and its box (x, y, w, h)
+        in the source image, nothing for a blank page
+        """
         try:
             # Convert paths to Path objects
             image_path = Path(image_path)
             output_folder = Path(output_folder)
             
             # Read the image using cv2.imdecode for Unicode support
-            img_array = np.fromfile(str(image_path), np.uint8)
-            img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            
-            if img is None:
-                raise ValueError(f"Cannot read image: {image_path}")
+            with timer('read'):
+                img_array = np.fromfile(str(image_path), np.uint8)
+            regions = []
+
+            if is_jpeg(image_path):
+                # Detect on a DCT-scaled 1/4 decode, then crop the JPEG data losslessly
+                with timer('decode'):
+                    gray = cv2.imdecode(img_array, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+                if gray is None:
+                    raise ValueError(f"Cannot read image: {image_path}")
+                with Image.open(image_path) as header:
+                    width, height = header.size
+                scale = (width / gray.shape[1], height / gray.shape[0])
+                boxes = self.segment_regions(gray, scale)
+                for index, box in enumerate(boxes, 1):
+                    x, y, w, h = self.pad_box(box, width, height, scale=scale)
+                    output_path = self.region_path(output_folder, image_path, index, len(boxes))
+                    with timer('encode'):
+                        left, top, right, bottom = lossless_crop(str(image_path), str(output_path),
+                                                                 (x, y, x + w, y + h))
+                    regions.append({'file': str(output_path), 'box': [left, top, right - left, bottom - top]})
+            else:
+                with timer('decode'):
+                    img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+                
+                if img is None:
+                    raise ValueError(f"Cannot read image: {image_path}")
+
+                crops = self.crop_regions(img)
+                for index, (box, image_content) in enumerate(crops, 1):
+                    # Save the extracted content with the same filename
+                    output_path = self.region_path(output_folder, image_path, index, len(crops))
+                    with timer('encode'), atomic_output(output_path) as tmp_path:
+                        cv2.imencode('.jpg', image_content)[1].tofile(tmp_path)
+                    regions.append({'file': str(output_path), 'box': list(box)})
+
+            count('crops', len(regions))
+            if regions:
+                self.logger.info(f"Extracted {len(regions)} region(s) of {image_path.name} to: {output_folder}")
+            else:
+                self.logger.warning(f"No image content found in {image_path}")
+            return regions
+
+        except Exception as e:
+            self.logger.error(f"Error processing {image_path}: {e}")
+            raise
 
-            # Convert to grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    def segment_regions(self, gray, scale=(1.0, 1.0)):
+        """
+        Boxes (x, y, w, h) of every image region of a grayscale image, in one pass
+        of connected components over a downscaled mask. Components smaller than
+        min_area pixels of the full image (scale: full image pixels per gray pixel)
+        are dropped, which leaves the characters of the text out, and nearby
+        components are merged into one region. Empty for a blank page
+        """
+        with timer('contour'):
+            height, width = gray.shape[:2]
+            factor = min(1.0, SEGMENT_SIZE / max(height, width))
+            if factor < 1.0:
+                gray = cv2.resize(gray, (max(1, round(width * factor)), max(1, round(height * factor))),
+                                  interpolation=cv2.INTER_AREA)
 
             # Binary threshold to separate content from background
-            _, binary = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
+            _, mask = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY_INV)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
 
-            # Find contours in the binary image
-            contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            # Label 0 is the background
+            stats = stats[1:]
+            pixel_area = scale[0] * scale[1] / (factor * factor)
+            boxes = stats[stats[:, cv2.CC_STAT_AREA] * pixel_area >= self.min_area, :4]
+            boxes = merge_boxes(boxes.tolist(), MERGE_GAP * max(mask.shape))
 
-            # Find the largest contour (likely the main image content)
-            main_contour = max(contours, key=cv2.contourArea)
-            x, y, w, h = cv2.boundingRect(main_contour)
+            return [(int(x / factor), int(y / factor),
+                     min(width, int(np.ceil((x + w) / factor))) - int(x / factor),
+                     min(height, int(np.ceil((y + h) / factor))) - int(y / factor))
+                    for x, y, w, h in boxes]
 
-            # Add a small padding
-            padding = 10
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(img.shape[1] - x, w + 2 * padding)
-            h = min(img.shape[0] - y, h + 2 * padding)
+    def text_regions(self, gray):
+        """
+        Boxes (x, y, w, h) of the content found outside the image regions
+        (captions, titles...), characters being merged into lines by a dilation
+        """
+        _, binary = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY_INV)
+        images = self.segment_regions(gray)
 
-            # Extract the region
-            image_content = img[y:y+h, x:x+w]
+        # Merge the characters of a line into one block
+        unit = max(1, gray.shape[1] // 100)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3 * unit, unit))
+        lines = cv2.dilate(binary, kernel)
+        line_contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            # Save the extracted content with the same filename
-            output_path = output_folder / image_path.name
-            cv2.imencode('.jpg', image_content)[1].tofile(str(output_path))
-            self.logger.info(f"Extracted content saved to: {output_path}")
+        regions = []
+        for contour in line_contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            overlap = sum(max(0, min(x + w, mx + mw) - max(x, mx)) * max(0, min(y + h, my + mh) - max(y, my))
+                          for mx, my, mw, mh in images)
+            if overlap < 0.5 * w * h and w * h >= unit * unit:
+                regions.append((x, y, w, h))
+        return regions
 
-            return True
+    def pad_box(self, box, width, height, scale=(1.0, 1.0)):
+        """Scale a box found on a reduced image to the full image and add the padding"""
+        x, y, w, h = box
+        x, w = int(x * scale[0]), int(np.ceil(w * scale[0]))
+        y, h = int(y * scale[1]), int(np.ceil(h * scale[1]))
 
-        except Exception as e:
-            self.logger.error(f"Error processing {image_path}: {e}")
-            raise
+        # Add a small padding
+        padding = self.padding
+        x = max(0, x - padding)
+        y = max(0, y - padding)
+        w = min(width - x, w + 2 * padding)
+        h = min(height - y, h + 2 * padding)
+        return x, y, w, h
+
+    def crop_regions(self, img):
+        """
+        Crop a decoded BGR image to each of its image regions, dropping the text
+        around them. Returns [((x, y, w, h), crop)] in reading order
+        """
+        # Convert to grayscale
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        crops = []
+        for box in self.segment_regions(gray):
+            x, y, w, h = self.pad_box(box, img.shape[1], img.shape[0])
+
+            # Extract the region
+            crops.append(((x, y, w, h), img[y:y+h, x:x+w]))
+        return crops
+
+    def crop_image_content(self, img):
+        """Crop a decoded BGR image to its main (largest) content, None for a blank page"""
+        crops = self.crop_regions(img)
+        if not crops:
+            return None
+        return max(crops, key=lambda crop: crop[0][2] * crop[0][3])[1]
 
-def main():
+def main(incremental: bool = True, dedup: bool = True, report_file: str = None):
+    """
+    Crop the image regions of every image of output_images. With dedup, the
+    crops of an identical image (same bytes, any folder) are copied instead
+    """
+    metrics.reset()
+    extractor = ImageContentExtractor(log_file='image_extraction.log')
+    manifest = Manifest.for_directory(extractor.base_output_dir)
+    seen = set()  # contenus déjà recadrés pendant ce lancement
     try:
-        extractor = ImageContentExtractor()
         image_folders = extractor.find_image_folders()
         
         if not image_folders:
@@ -116,14 +276,36 @@ def main():
             
             for i, image_file in enumerate(images, 1):
                 image_path = Path(folder) / image_file
-                print(f"Processing {image_file} ({i}/{len(images)})...")
-                extractor.extract_image_content(str(image_path), extraction_folder)
-                print(f"→ Image content extracted")
+                image_hash = manifest.file_hash(str(image_path))
+                if incremental and manifest.is_done('crop', str(image_path), image_hash, extractor.params):
+                    print(f"Unchanged, skipped {image_file} ({i}/{len(images)})")
+                    continue
+                found = None
+                if dedup and (incremental or image_hash in seen):
+                    found = manifest.find('crop', image_hash, extractor.params)
+                if found:
+                    source_path, entry = found
+                    copies = copy_outputs(entry['outputs'], Path(source_path).stem, image_path.stem,
+                                          extraction_folder)
+                    regions = [{**region, 'file': copies[region['file']]} for region in entry['data']['regions']]
+                    print(f"Identical image already processed, crops copied: {image_file} ({i}/{len(images)})")
+                else:
+                    print(f"Processing {image_file} ({i}/{len(images)})...")
+                    regions = extractor.extract_image_content(str(image_path), extraction_folder)
+                seen.add(image_hash)
+                manifest.record('crop', str(image_path), image_hash, extractor.params,
+                                [region['file'] for region in regions], data={'regions': regions})
+                add_outputs(region['file'] for region in regions)
+                print(f"→ {len(regions)} image region(s) extracted")
         
         print("\nProcessing complete. Check image_extraction.log for details.")
         
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        manifest.save()
+        if report_file:
+            metrics.write_report(report_file, command='extract_images_completly')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
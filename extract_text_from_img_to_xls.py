@@ -3,112 +3,348 @@ import pytesseract
 from PIL import Image
 import pandas as pd
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font
 from openpyxl.utils import get_column_letter
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+import fitz
+import cv2
+import numpy as np
 
-def create_excel_file():
-    wb = Workbook()
-    ws = wb.active
-    
-    headers = [
-        'Document ID', 'Page', 'Position', 'Filename',
-        'Text Content', 'Date', 'Characters', 'Words', 'Path', 'Source Folder'
-    ]
-    
-    # Style d'en-tête
-    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-    
-    # Ajuster largeur des colonnes
-    ws.column_dimensions['A'].width = 20  # Document ID
-    ws.column_dimensions['B'].width = 8   # Page
-    ws.column_dimensions['C'].width = 10  # Position
-    ws.column_dimensions['D'].width = 20  # Filename
-    ws.column_dimensions['E'].width = 50  # Text Content
-    ws.column_dimensions['F'].width = 20  # Date
-    ws.column_dimensions['G'].width = 12  # Characters
-    ws.column_dimensions['H'].width = 8   # Words
-    ws.column_dimensions['I'].width = 50  # Path
-    ws.column_dimensions['J'].width = 15  # Source Folder
-    
-    return wb, ws
+from manifest import Manifest
+from dedup import image_digest
+from fs_index import get_index
+from output_sinks import open_sink
+from extract_images_completly import ImageContentExtractor
+from extract_double_image_jpg import split_axes
+from instrumentation import collect, count, metrics, timer, with_metrics
+
+# One Tesseract thread per OCR worker: the pool already uses every core, OpenMP threads
+# would only oversubscribe them. OpenMP reads it when libtesseract is loaded, so it is set
+# before importing tesserocr, and the workers and tesseract subprocesses inherit it
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+try:
+    # Optionnel : moteur Tesseract persistant (pas de sous-processus par image)
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+if os.name == 'nt':
+    pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def process_image(file_path, filename, td_folder, source_folder, ws, row):
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Couche texte du PDF : utilisée à la place de l'OCR quand elle semble fiable
+TEXT_LAYER_MIN_CHARS = 20
+TEXT_LAYER_MIN_QUALITY = 0.85
+TEXT_CHARACTERS = set(".,;:!?'\"()[]-–—«»%€$/&+*=°’")
+POSITION_ORDER = {'top': 0, 'left': 0, 'bottom': 1, 'right': 1}
+POSITION_AXIS = {'top': 0, 'bottom': 0, 'left': 1, 'right': 1}
+
+# Moteur OCR de chaque processus worker, créé une seule fois par _init_ocr_worker
+_worker_lang = 'fra'
+_worker_api = None
+_worker_extractor = None
+
+def ocr_image(img, lang='fra'):
+    """Run Tesseract on an already opened image and return the stripped text"""
+    return pytesseract.image_to_string(img, lang=lang).strip()
+
+def _init_ocr_worker(lang='fra', regions=False):
+    """
+    Pool initializer: when tesserocr is installed, one engine kept loaded for
+    the whole life of the worker (see OMP_THREAD_LIMIT above for its threads)
+    """
+    global _worker_lang, _worker_api, _worker_extractor
+    _worker_lang = lang
+    if tesserocr is not None:
+        _worker_api = tesserocr.PyTessBaseAPI(lang=lang)
+    if regions:
+        _worker_extractor = ImageContentExtractor()
+
+def text_regions_image(file_path):
+    """
+    Grayscale copy of the image where only the text regions found outside the main
+    image contour are kept (the rest is blanked), or None when there is no text region
+    """
+    gray = cv2.imdecode(np.fromfile(file_path, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Cannot read image: {file_path}")
+    regions = _worker_extractor.text_regions(gray)
+    if not regions:
+        return None
+    masked = np.full_like(gray, 255)
+    for x, y, w, h in regions:
+        masked[y:y+h, x:x+w] = gray[y:y+h, x:x+w]
+    return Image.fromarray(masked)
+
+def ocr_file(file_path):
+    """
+    Worker task: OCR one image file, or only its text regions when the pool was
+    started with regions=True. An image without any region found (a frame or a
+    table taken for one big image) is read whole. Returns (text, error message)
+    """
     try:
-        parts = filename.replace('.jpg', '').split('_')
-        page_number = parts[1] if len(parts) > 1 else ''
-        page_position = parts[2] if len(parts) > 2 else ''
-        
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img, lang='fra')
-        text_stripped = text.strip()
-        
-        # Remplir la ligne
-        ws.cell(row=row, column=1, value=td_folder)
-        ws.cell(row=row, column=2, value=page_number)
-        ws.cell(row=row, column=3, value=page_position)
-        ws.cell(row=row, column=4, value=filename)
-        ws.cell(row=row, column=5, value=text_stripped)
-        ws.cell(row=row, column=6, value=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        ws.cell(row=row, column=7, value=len(text_stripped))
-        ws.cell(row=row, column=8, value=len(text_stripped.split()))
-        ws.cell(row=row, column=9, value=file_path)
-        ws.cell(row=row, column=10, value=source_folder)
-        
-        print(f"Processed: {filename} from {source_folder}")
-        return True
-        
+        image = None
+        if _worker_extractor is not None:
+            # None : aucune zone de texte trouvée, toute l'image part à l'OCR
+            image = text_regions_image(file_path)
+        count('ocr_images')
+        with timer('ocr'):
+            if _worker_api is not None:
+                if image is not None:
+                    _worker_api.SetImage(image)
+                else:
+                    _worker_api.SetImageFile(file_path)
+                return _worker_api.GetUTF8Text().strip(), None
+            # Passing the path lets tesseract read the file itself, without a temp copy
+            return pytesseract.image_to_string(image if image is not None else file_path,
+                                               lang=_worker_lang).strip(), None
     except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-        return False
+        return None, str(e)
 
-def extract_text_from_images():
-    excel_file = 'extracted_text.xlsx'
-    base_dir = 'output_images'
-    
-    wb, ws = create_excel_file()
-    row = 2  # Start after header
+def ocr_files(file_paths, lang='fra', max_workers=None, regions=False):
+    """
+    OCR the files in parallel with a pool of Tesseract workers sized to the
+    core count. Yields (text, error message) in the same order as file_paths
+    """
+    file_paths = list(file_paths)
+    if not file_paths:
+        return
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    max_workers = max(1, min(max_workers, len(file_paths)))
+    chunksize = max(1, min(8, len(file_paths) // (max_workers * 4)))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_ocr_worker,
+                             initargs=(lang, regions)) as executor:
+        for packed in executor.map(with_metrics, [ocr_file] * len(file_paths), file_paths, chunksize=chunksize):
+            yield collect(packed)
+
+def parse_filename(filename):
+    """(page number, position) from page_N[_position].jpg"""
+    parts = os.path.splitext(filename)[0].split('_')
+    page_number = parts[1] if len(parts) > 1 else ''
+    page_position = parts[2] if len(parts) > 2 else ''
+    return page_number, page_position
+
+def text_layer_quality(text):
+    """
+    Share of the characters that look like real text (letters, digits, usual
+    punctuation). 0 for a missing or too short text layer or one with
+    undecodable characters (broken font encoding)
+    """
+    if len(text) < TEXT_LAYER_MIN_CHARS or text.count('\ufffd') > 0.01 * len(text):
+        return 0.0
+    good = sum(c.isalnum() or c.isspace() or c in TEXT_CHARACTERS for c in text)
+    return good / len(text)
+
+def part_fractions(images, axes=None):
+    """
+    Box (x0, y0, x1, y1) of each split image on its page, as fractions of the
+    page, computed from the sizes of the parts of the same page. The split axis
+    comes from the part names (top/bottom, left/right) or, for part1..partN,
+    from axes ({absolute part path: axis}, see split_axes); parts of a page
+    whose axis is unknown get no box
+    """
+    axes = axes or {}
+    groups = {}
+    for file_path, filename, td_folder, _ in images:
+        page_number, position = parse_filename(filename)
+        if position in POSITION_ORDER or (position.startswith('part') and position[4:].isdigit()):
+            groups.setdefault((td_folder, page_number), []).append((position, file_path))
     
-    for td_folder in os.listdir(base_dir):
+    fractions = {}
+    for parts in groups.values():
+        parts.sort(key=lambda part: POSITION_ORDER[part[0]] if part[0] in POSITION_ORDER else int(part[0][4:]))
+        split_axis = POSITION_AXIS.get(parts[0][0])
+        if split_axis is None:
+            split_axis = next((axes[os.path.abspath(file_path)] for _, file_path in parts
+                               if os.path.abspath(file_path) in axes), None)
+        if split_axis is None:
+            continue
+        sizes = []
+        for _, file_path in parts:
+            with Image.open(file_path) as img:
+                sizes.append(img.size)
+        side_by_side = split_axis == 1
+        lengths = [w if side_by_side else h for w, h in sizes]
+        start = 0
+        for (_, file_path), length in zip(parts, lengths):
+            stop = start + length
+            a, b = start / sum(lengths), stop / sum(lengths)
+            fractions[file_path] = (a, 0.0, b, 1.0) if side_by_side else (0.0, a, 1.0, b)
+            start = stop
+    return fractions
+
+def text_from_layer(doc, page_number, fraction=None):
+    """Text of the PDF page (1-based), restricted to a fraction box of the page"""
+    with timer('text_layer'):
+        page = doc[int(page_number) - 1]
+        clip = None
+        if fraction:
+            rect = page.rect
+            clip = fitz.Rect(rect.x0 + fraction[0] * rect.width, rect.y0 + fraction[1] * rect.height,
+                             rect.x0 + fraction[2] * rect.width, rect.y0 + fraction[3] * rect.height)
+        return page.get_text('text', clip=clip, sort=True).strip()
+
+def make_row(td_folder, page_number, page_position, filename, text_stripped, file_path, source_folder):
+    """Values of one output row, in the order of output_sinks.HEADERS"""
+    return [
+        td_folder, page_number, page_position, filename, text_stripped,
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        len(text_stripped), len(text_stripped.split()), file_path, source_folder,
+    ]
+
+def find_images(base_dir):
+    """
+    List the images to OCR as (file_path, filename, td_folder, source_folder),
+    in the order their rows go to the Excel file. The tree is read from the
+    shared index (see fs_index), not walked again
+    """
+    index = get_index(base_dir)
+    images = []
+    for td_folder in index.dirs(base_dir):
         td_path = os.path.join(base_dir, td_folder)
         
-        # Traiter les images dans doubles_images_pages/split_images
-        doubles_dir = os.path.join(td_path, 'doubles_images_pages', 'split_images')
-        if os.path.exists(doubles_dir):
-            for filename in os.listdir(doubles_dir):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_path = os.path.join(doubles_dir, filename)
-                    if process_image(file_path, filename, td_folder, 'doubles_images_pages', ws, row):
-                        row += 1
-                    
-                    # Sauvegarder régulièrement
-                    if row % 10 == 0:
-                        wb.save(excel_file)
-        
-        # Traiter les images dans une_image_page
-        une_image_dir = os.path.join(td_path, 'une_image_page')
-        if os.path.exists(une_image_dir):
-            for filename in os.listdir(une_image_dir):
-                if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    file_path = os.path.join(une_image_dir, filename)
-                    if process_image(file_path, filename, td_folder, 'une_image_page', ws, row):
-                        row += 1
-                    
-                    # Sauvegarder régulièrement
-                    if row % 10 == 0:
-                        wb.save(excel_file)
+        # Images dans doubles_images_pages/split_images puis dans une_image_page
+        for source_folder, image_dir in (
+                ('doubles_images_pages', os.path.join(td_path, 'doubles_images_pages', 'split_images')),
+                ('une_image_page', os.path.join(td_path, 'une_image_page'))):
+            for filename in index.files(image_dir):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append((os.path.join(image_dir, filename), filename, td_folder, source_folder))
+    return images
+
+def extract_text_from_images(incremental=True, lang='fra', max_workers=None,
+                             output_file='extracted_text.xlsx', output_format=None,
+                             text_layer=True, pdf_dir='pdfs', min_quality=TEXT_LAYER_MIN_QUALITY,
+                             ocr_regions=True, dedup=True, report_file=None, base_dir='output_images',
+                             split_root=None):
+    """
+    OCR every image of base_dir into output_file. The format (xlsx, csv,
+    jsonl or parquet) comes from output_format or the file extension; rows are
+    streamed to the file instead of saving the whole workbook again and again.
+    With text_layer, the text of born-digital pages is read from the PDF
+    (pdf_dir/<document>.pdf) when its quality is at least min_quality, only
+    scanned or image-only pages go to Tesseract. With ocr_regions, Tesseract only
+    sees the text regions outside the main image of the page. With dedup,
+    identical images (same bytes, any document) are read once and their text
+    reused, each of them still gets its row. Every text is journaled in the
+    manifest as soon as it is read: after a crash, a new run only OCRs the
+    images left and writes the output again from the journal.
+    split_root: folder given to batch_process_directories, whose manifest holds
+    the split axes of the parts (base_dir by default)
+    report_file: JSON run report, see instrumentation
+    """
+    metrics.reset()
+    manifest = Manifest.for_directory(base_dir) if incremental else None
+    # Les axes de découpe sont dans le manifeste du dossier donné à batch_process_directories
+    split_manifest = manifest
+    if split_root is not None and os.path.abspath(split_root) != os.path.abspath(base_dir):
+        split_manifest = Manifest.for_directory(split_root)
+    params = {'lang': lang, 'text_layer': text_layer, 'min_quality': min_quality, 'ocr_regions': ocr_regions}
+    
+    images = find_images(base_dir)
+    
+    # Texte déjà extrait pour les images inchangées, ou pour une image identique ailleurs
+    hashes = {}
+    cached = {}
+    reused = 0
+    for file_path, *_ in images:
+        if manifest:
+            hashes[file_path] = manifest.file_hash(file_path)
+            entry = manifest.get('ocr', file_path, hashes[file_path], params)
+            if entry:
+                cached[file_path] = entry['data']['text']
+                continue
+            found = manifest.find('ocr', hashes[file_path], params) if dedup else None
+            if found:
+                cached[file_path] = found[1]['data']['text']
+                manifest.record('ocr', file_path, hashes[file_path], params, data={'text': cached[file_path]})
+                reused += 1
+        elif dedup:
+            hashes[file_path] = image_digest(file_path)
+    
+    # Pages nativement numériques : lire la couche texte du PDF au lieu de l'OCR
+    from_layer = 0
+    if text_layer:
+        fractions = part_fractions([image for image in images if image[0] not in cached],
+                                   split_axes(split_manifest) if split_manifest else None)
+        documents = {}
+        for file_path, filename, td_folder, source_folder in images:
+            if file_path in cached:
+                continue
+            # Partie d'une page divisée dont la position est inconnue : OCR plutôt que le texte de toute la page
+            if source_folder == 'doubles_images_pages' and file_path not in fractions:
+                continue
+            page_number, _ = parse_filename(filename)
+            pdf_path = os.path.join(pdf_dir, f"{td_folder}.pdf")
+            if not page_number.isdigit() or not os.path.exists(pdf_path):
+                continue
+            try:
+                if pdf_path not in documents:
+                    documents[pdf_path] = fitz.open(pdf_path)
+                text = text_from_layer(documents[pdf_path], page_number, fractions.get(file_path))
+            except Exception as e:
+                print(f"Error reading the text layer of {file_path}: {e}")
+                continue
+            if text_layer_quality(text) >= min_quality:
+                cached[file_path] = text
+                from_layer += 1
+                if manifest:
+                    manifest.record('ocr', file_path, hashes[file_path], params, data={'text': text})
+        for doc in documents.values():
+            doc.close()
+    
+    # Une seule lecture par contenu : les doublons prennent le texte de la première image
+    to_ocr = []
+    first_seen = {}
+    same_as = {}
+    for file_path, *_ in images:
+        if file_path in cached:
+            continue
+        if dedup and hashes[file_path] in first_seen:
+            same_as[file_path] = first_seen[hashes[file_path]]
+            continue
+        if dedup:
+            first_seen[hashes[file_path]] = file_path
+        to_ocr.append(file_path)
+    print(f"Found {len(images)} images, {from_layer} read from the PDF text layer, "
+          f"{reused + len(same_as)} identical to another image, {len(to_ocr)} to OCR")
+    
+    # Les résultats reviennent dans l'ordre, les lignes aussi
+    results = ocr_files(to_ocr, lang=lang, max_workers=max_workers, regions=ocr_regions)
+    ocr_texts = {}
+    with open_sink(output_file, output_format) as sink:
+        for file_path, filename, td_folder, source_folder in images:
+            if file_path in cached:
+                text_stripped = cached[file_path]
+            else:
+                if file_path in same_as:
+                    # The first image with this content comes earlier in the rows
+                    text_stripped, error = ocr_texts[same_as[file_path]]
+                else:
+                    text_stripped, error = ocr_texts[file_path] = next(results)
+                if error is not None:
+                    print(f"Error processing {file_path}: {error}")
+                    if manifest:
+                        manifest.fail('ocr', file_path, error)
+                    continue
+                if manifest:
+                    manifest.record('ocr', file_path, hashes[file_path], params, data={'text': text_stripped})
+            
+            page_number, page_position = parse_filename(filename)
+            sink.write_row(make_row(td_folder, page_number, page_position, filename,
+                                    text_stripped, file_path, source_folder))
+            print(f"Processed: {filename} from {source_folder}")
     
-    wb.save(excel_file)
-    print(f"Excel file saved: {excel_file}")
+    if manifest:
+        manifest.save()
+    print(f"Output file saved: {output_file}")
+    if report_file:
+        metrics.write_report(report_file, command='extract_text_from_images', lang=lang,
+                             images=len(images), from_text_layer=from_layer, identical=reused + len(same_as))
 
 if __name__ == "__main__":
     extract_text_from_images()
\ No newline at end of file
@@ -0,0 +1,161 @@
+#one scan of an output tree shared by every stage: os.scandir with concurrent directory reads
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Directories read at the same time: on network storage each read mostly waits for the server
+SCAN_WORKERS = 16
+
+logger = logging.getLogger(__name__)
+
+
+def _read_dir(path: str) -> tuple:
+    """(subdirectory names, file names, subdirectories to descend into) of path"""
+    dirs, files, subdirs = [], [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs.append(entry.name)
+                    # Like os.walk: symbolic links to folders are listed, not followed
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError as e:
+        logger.warning(f"Cannot read {path}: {e}")
+    return dirs, files, subdirs
+
+
+class FileIndex:
+    def __init__(self, root: str, workers: int = SCAN_WORKERS):
+        """
+        Folders and files under root, read once by scan() and then kept up to
+        date by the stages that write or move files (add, remove) instead of
+        walking the tree again. Paths are returned spelled from the folder
+        given to the query, like os.walk does
+        """
+        self.root = os.path.abspath(root)
+        self.workers = workers
+        self.tree = {}  # absolute folder -> [subfolder names, file names] (dicts used as ordered sets)
+        self.lock = threading.Lock()
+
+    def scan(self):
+        """Read every folder of the tree, up to `workers` folders at the same time"""
+        start = time.perf_counter()
+        tree = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(_read_dir, self.root): self.root} if os.path.isdir(self.root) else {}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    dirs, files, subdirs = future.result()
+                    tree[path] = [dict.fromkeys(dirs), dict.fromkeys(files)]
+                    for name in subdirs:
+                        child = os.path.join(path, name)
+                        pending[executor.submit(_read_dir, child)] = child
+        with self.lock:
+            self.tree = tree
+        logger.info(f"Indexed {self.root}: {len(tree)} folders, {sum(len(entry[1]) for entry in tree.values())} "
+                    f"files in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def covers(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def isdir(self, path: str) -> bool:
+        return os.path.abspath(path) in self.tree
+
+    def dirs(self, path: str) -> list:
+        entry = self.tree.get(os.path.abspath(path))
+        return list(entry[0]) if entry else []
+
+    def files(self, path: str) -> list:
+        entry = self.tree.get(os.path.abspath(path))
+        return list(entry[1]) if entry else []
+
+    def listdir(self, path: str) -> list:
+        """Same as os.listdir(path), from the index"""
+        return self.dirs(path) + self.files(path)
+
+    def walk(self, top: str):
+        """Same as os.walk(top) (top-down, dirs can be pruned in place), from the index"""
+        entry = self.tree.get(os.path.abspath(top))
+        if entry is None:
+            return
+        dirs, files = list(entry[0]), list(entry[1])
+        yield top, dirs, files
+        for name in dirs:
+            child = os.path.join(top, name)
+            if os.path.abspath(child) in self.tree:
+                yield from self.walk(child)
+
+    def _add_dir(self, folder: str):
+        if folder in self.tree:
+            return
+        self.tree[folder] = [{}, {}]
+        if folder != self.root:
+            parent, name = os.path.split(folder)
+            self._add_dir(parent)
+            self.tree[parent][0][name] = None
+
+    def add(self, path: str):
+        """Register a file written by a stage, with the folders leading to it"""
+        path = os.path.abspath(path)
+        if path == self.root or not self.covers(path):
+            return
+        folder, name = os.path.split(path)
+        with self.lock:
+            self._add_dir(folder)
+            self.tree[folder][1][name] = None
+
+    def remove(self, path: str):
+        """Forget a file moved or deleted by a stage"""
+        folder, name = os.path.split(os.path.abspath(path))
+        with self.lock:
+            entry = self.tree.get(folder)
+            if entry:
+                entry[1].pop(name, None)
+
+
+# Index of each scanned tree, shared by the stages run in this process
+_indexes = []
+
+
+def get_index(root: str, refresh: bool = False) -> FileIndex:
+    """
+    Index of the tree under root, scanned on first use and then shared by every
+    stage run in the process (the index of a parent folder is reused).
+    refresh scans again, for files changed by something else than the stages
+    """
+    for index in _indexes:
+        if index.covers(root):
+            return index.scan() if refresh else index
+    index = FileIndex(root).scan()
+    if os.path.isdir(root):
+        _indexes.append(index)
+    return index
+
+
+def add_outputs(paths):
+    """Add files written by a stage to the indexes that cover them"""
+    paths = list(paths)
+    for index in _indexes:
+        for path in paths:
+            index.add(path)
+
+
+def moved(moves: dict):
+    """Follow files moved by a stage (old path -> new path)"""
+    for index in _indexes:
+        for old_path, new_path in moves.items():
+            index.remove(old_path)
+            index.add(new_path)
@@ -0,0 +1,203 @@
+#per-stage timers, counters and peak memory, merged from the workers into one JSON run report
+import os
+import sys
+import time
+import json
+import logging
+import cProfile
+import threading
+from multiprocessing.util import Finalize
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Windows : pas de module resource, psutil s'il est installé
+    resource = None
+
+# Directory where every process dumps its cProfile stats (<pid>.prof), profiling is off when unset
+PROFILE_ENV = 'PDF2DATA_PROFILE'
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss():
+    """Peak resident memory of the current process in bytes, None when unknown"""
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Time spent per stage (open, render, encode, decode, split, contour, ocr,
+        write...), counters (pages, images...) and peak memory of the workers.
+        One instance per process, see `metrics`
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new run: the clock restarts and everything measured so far is forgotten"""
+        with self.lock:
+            self.started = time.perf_counter()
+            self.started_at = datetime.now()
+            self.stages = {}   # stage -> [calls, seconds, max seconds]
+            self.counters = {}
+            self.workers = {}  # pid -> peak RSS
+
+    def clear(self):
+        """Forget the stages and counters (a worker does it before each task)"""
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def add_time(self, stage: str, seconds: float):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        """What a worker sends back to the main process with each result"""
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'peak_rss': peak_rss(),
+                'stages': {stage: list(entry) for stage, entry in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, snapshot: dict):
+        """Add the snapshot of a worker to the totals of this process"""
+        with self.lock:
+            for stage, (calls, seconds, longest) in snapshot['stages'].items():
+                entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] = max(entry[2], longest)
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            if snapshot['peak_rss'] is not None:
+                self.workers[snapshot['pid']] = max(self.workers.get(snapshot['pid'], 0), snapshot['peak_rss'])
+
+    def report(self, **info) -> dict:
+        """Run report: wall time, time per stage, counters and their rate, peak memory"""
+        wall = time.perf_counter() - self.started
+        with self.lock:
+            return {
+                'started': self.started_at.isoformat(timespec='seconds'),
+                'wall_seconds': round(wall, 3),
+                'stages': {
+                    stage: {'calls': calls, 'seconds': round(seconds, 3),
+                            'mean_seconds': round(seconds / calls, 4) if calls else 0.0,
+                            'max_seconds': round(longest, 4)}
+                    for stage, (calls, seconds, longest) in sorted(self.stages.items(), key=lambda item: -item[1][1])
+                },
+                'counters': dict(self.counters),
+                'per_second': {name: round(n / wall, 3) for name, n in self.counters.items()} if wall else {},
+                'peak_rss': {'main': peak_rss(), 'workers': {str(pid): rss for pid, rss in self.workers.items()}},
+                **info,
+            }
+
+    def write_report(self, report_path: str, **info) -> dict:
+        """Write the JSON run report and log where the time went"""
+        report = self.report(**info)
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        for stage, entry in report['stages'].items():
+            logger.info(f"{stage}: {entry['seconds']}s over {entry['calls']} calls")
+        logger.info(f"Run report saved: {report_path}")
+        return report
+
+
+# Métriques du processus courant
+metrics = Metrics()
+
+
+@contextmanager
+def timer(stage: str):
+    """Add the time spent in the block to the stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(stage, time.perf_counter() - start)
+
+
+def count(name: str, n: int = 1):
+    metrics.count(name, n)
+
+
+_profiler = None
+
+def _dump_profile(profile_dir: str):
+    _profiler.dump_stats(os.path.join(profile_dir, f"{os.getpid()}.prof"))
+
+def with_metrics(func, *args):
+    """
+    Run func(*args) in a pool worker and return (result, snapshot of the metrics
+    of this call), to unpack with collect() in the main process. When
+    PDF2DATA_PROFILE is set, the worker is also profiled into <dir>/<pid>.prof,
+    written once when the worker exits
+    """
+    global _profiler
+    metrics.clear()
+    profile_dir = os.environ.get(PROFILE_ENV)
+    if profile_dir and _profiler is None:
+        _profiler = cProfile.Profile()
+        os.makedirs(profile_dir, exist_ok=True)
+        # Run by multiprocessing when the worker process ends
+        Finalize(None, _dump_profile, args=(profile_dir,), exitpriority=10)
+    if _profiler is not None:
+        _profiler.enable()
+    try:
+        result = func(*args)
+    finally:
+        if _profiler is not None:
+            _profiler.disable()
+    return result, metrics.snapshot()
+
+
+def collect(packed):
+    """Merge the worker metrics returned by with_metrics and return the result"""
+    result, snapshot = packed
+    metrics.merge(snapshot)
+    return result
+
+
+@contextmanager
+def profiled(profile_path: str = None):
+    """
+    Profile the block with cProfile and dump the stats to profile_path (or to
+    <PDF2DATA_PROFILE>/<pid>.prof), readable with pstats or snakeviz.
+    Does nothing when neither is set
+    """
+    profile_dir = os.environ.get(PROFILE_ENV)
+    if profile_path is None and profile_dir:
+        profile_path = os.path.join(profile_dir, f"{os.getpid()}.prof")
+    if profile_path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(profile_path) or '.', exist_ok=True)
+        profiler.dump_stats(profile_path)
+        logger.info(f"Profile saved: {profile_path}")
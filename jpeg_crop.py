@@ -0,0 +1,78 @@
+#crop JPEG files without decoding and re-encoding them (jpegtran -crop), reduced decode for detection
+import shutil
+import subprocess
+import logging
+from PIL import Image, JpegImagePlugin
+
+from manifest import atomic_output
+
+# jpegtran (libjpeg-turbo) is optional, without it crops are re-encoded with the original tables
+JPEGTRAN = shutil.which('jpegtran')
+
+logger = logging.getLogger(__name__)
+
+
+def is_jpeg(image_path: str) -> bool:
+    return str(image_path).lower().endswith(('.jpg', '.jpeg'))
+
+
+def mcu_size(image) -> tuple:
+    """
+    (width, height) of a JPEG MCU: lossless crops must start on these boundaries
+    """
+    layers = getattr(image, 'layer', None) or [(None, 1, 1, None)]
+    return 8 * max(layer[1] for layer in layers), 8 * max(layer[2] for layer in layers)
+
+
+def align_box(box: tuple, mcu: tuple) -> tuple:
+    """
+    Move the top-left corner of (left, top, right, bottom) up/left to the nearest
+    MCU boundary, the bottom-right corner is kept
+    """
+    left, top, right, bottom = box
+    return left - left % mcu[0], top - top % mcu[1], right, bottom
+
+
+def open_reduced(image_path: str, max_size: int = 1024, mode: str = 'L'):
+    """
+    Open a JPEG with a DCT-scaled decode (1/2, 1/4 or 1/8 of the size) that is
+    enough for detection. Returns (image, (scale_x, scale_y)) where the scale
+    maps reduced coordinates back to the full image
+    """
+    image = Image.open(image_path)
+    full_size = image.size
+    if image.format == 'JPEG':
+        image.draft(mode, (max(1, full_size[0] * max_size // max(full_size)),
+                           max(1, full_size[1] * max_size // max(full_size))))
+    image = image.convert(mode)
+    return image, (full_size[0] / image.width, full_size[1] / image.height)
+
+
+def lossless_crop(image_path: str, output_path: str, box: tuple) -> tuple:
+    """
+    Crop box = (left, top, right, bottom) out of a JPEG file without touching the
+    compressed data (jpegtran -crop). The top-left corner is aligned on the MCU
+    grid, so the crop may start a few pixels earlier. Falls back to a re-encode
+    with the original quantization tables and subsampling when jpegtran is not
+    available. Returns the box actually written
+    """
+    with Image.open(image_path) as image, atomic_output(output_path) as tmp_path:
+        box = align_box(box, mcu_size(image))
+        left, top, right, bottom = box
+        if JPEGTRAN:
+            result = subprocess.run(
+                [JPEGTRAN, '-copy', 'all', '-crop', f"{right - left}x{bottom - top}+{left}+{top}",
+                 '-outfile', tmp_path, image_path],
+                capture_output=True
+            )
+            if result.returncode == 0:
+                return box
+            logger.warning(f"jpegtran failed on {image_path}, re-encoding: {result.stderr.decode(errors='replace')}")
+
+        options = {'quality': 95}
+        if image.format == 'JPEG' and image.mode != 'P':
+            options = {'qtables': image.quantization, 'subsampling': JpegImagePlugin.get_sampling(image)}
+            if options['subsampling'] == -1:
+                del options['subsampling']
+        image.crop(box).save(tmp_path, 'JPEG', **options)
+        return box
@@ -3,18 +3,88 @@ import fitz
 import os
 from pathlib import Path
 import logging
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import multiprocessing
+import json
+
+from manifest import Manifest, atomic_output, remove_partial_outputs
+from dedup import copy_outputs, page_digest
+from fs_index import add_outputs
+from instrumentation import collect, count, metrics, timer, with_metrics
+from bounded_render import IMAGE_FORMATS, estimate_pixmap_bytes, page_budget, render_page_bounded, save_pixmap
+
+# Embedded image mode: a page whose raster images cover at least this share of the
+# page and that has few vector drawings is extracted directly, other pages are rendered
+EMBEDDED_MIN_COVERAGE = 0.2
+MAX_VECTOR_DRAWINGS = 200  # lines, curves and rectangles, not paths (one path can hold hundreds of lines)
+# Encodings written as they are, the next steps (convertPNGtoJPG, split, OCR) cannot read the others (jpx, jb2...)
+EMBEDDED_FORMATS = ('jpeg', 'png')
+POSITIONS_FILE = 'images.json'
+
+# Documents opened once per worker process and kept for its whole life
+_worker_docs = {}
+MAX_OPEN_DOCUMENTS = 8
+
+def _get_document(pdf_path: str):
+    """
+    Return the worker's open copy of the PDF, opening it on first use.
+    The least recently used document is closed when too many are open
+    """
+    doc = _worker_docs.pop(pdf_path, None)
+    if doc is None:
+        if len(_worker_docs) >= MAX_OPEN_DOCUMENTS:
+            oldest = next(iter(_worker_docs))
+            _worker_docs.pop(oldest).close()
+        with timer('open'):
+            doc = fitz.open(pdf_path)
+    _worker_docs[pdf_path] = doc
+    return doc
+
+def drawing_items(page) -> int:
+    """
+    Number of vector drawing items (lines, curves, rectangles) of the page
+    """
+    return sum(len(drawing['items']) for drawing in page.get_cdrawings())
+
+def _init_worker(pdf_path: str = None):
+    """
+    Pool initializer: open the PDF once for the whole life of the worker
+    """
+    if pdf_path:
+        _get_document(pdf_path)
+
+def render_options(dpi: int = 300, mode: str = 'render', min_coverage: float = EMBEDDED_MIN_COVERAGE,
+                   max_page_bytes: int = None, oversize: str = 'bands', image_format: str = 'png',
+                   quality: int = 95) -> dict:
+    """Options passed to the workers with each chunk of pages"""
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format '{image_format}', expected one of {', '.join(IMAGE_FORMATS)}")
+    return {'dpi': dpi, 'mode': mode, 'min_coverage': min_coverage, 'max_page_bytes': max_page_bytes,
+            'oversize': oversize, 'image_format': image_format, 'quality': quality}
 
 class FastPDFExtractor:
-    def __init__(self, pdf_path: str, output_dir: str, dpi: int = 300):
+    def __init__(self, pdf_path: str, output_dir: str, dpi: int = 300, mode: str = 'render',
+                 min_coverage: float = EMBEDDED_MIN_COVERAGE, max_page_pixels: int = None,
+                 max_page_bytes: int = None, oversize: str = 'bands', image_format: str = 'png',
+                 quality: int = 95):
         """
-        Initialize the extractor with PDF path and output directory
+        Initialize the extractor with PDF path and output directory.
+        mode='render' rasterizes every page, mode='embedded' writes the embedded
+        images of photo pages as they are stored in the PDF and renders the others.
+        Pages whose pixmap would exceed max_page_pixels / max_page_bytes (A0 plans...)
+        are rendered in bands streamed to disk (oversize='bands') or at a lower DPI
+        (oversize='reduce_dpi'), see bounded_render.
+        image_format 'jpg' or 'webp' writes rendered pages straight in that format
+        (at quality) instead of PNG files that only get converted afterwards
         """
         self.pdf_path = pdf_path
         self.pdf_name = Path(pdf_path).stem
         self.output_dir = os.path.join(output_dir, self.pdf_name)
         self.dpi = dpi
+        self.mode = mode
+        self.min_coverage = min_coverage
+        self.options = render_options(dpi, mode, min_coverage, page_budget(max_page_pixels, max_page_bytes),
+                                      oversize, image_format, quality)
         
         # Configure logging
         logging.basicConfig(
@@ -26,9 +96,12 @@ class FastPDFExtractor:
     @staticmethod
     def process_page(args):
         """
-        Static method to process a single page (needed for multiprocessing)
+        Static method to process a single page (needed for multiprocessing).
+        The image format comes from the output_path extension (png, jpg, webp),
+        an optional fifth argument gives the JPEG/WebP quality
         """
-        pdf_path, page_num, output_path, dpi = args
+        pdf_path, page_num, output_path, dpi = args[:4]
+        quality = args[4] if len(args) > 4 else 95
         try:
             # Open the PDF file within the process
             doc = fitz.open(pdf_path)
@@ -37,7 +110,7 @@ class FastPDFExtractor:
             # Convert page to high-resolution image
             matrix = fitz.Matrix(dpi/72, dpi/72)
             pix = page.get_pixmap(matrix=matrix)
-            pix.save(output_path)
+            save_pixmap(pix, output_path, quality)
             
             # Close the document
             doc.close()
@@ -46,9 +119,114 @@ class FastPDFExtractor:
             print(f"Error processing page {page_num + 1}: {e}")
             return False
 
+    @staticmethod
+    def embedded_images(doc, page, min_coverage: float = EMBEDDED_MIN_COVERAGE):
+        """
+        Embedded raster images of a photo page as a list of (info, image) where info
+        holds the position on the page (get_image_info) and image the stream in its
+        native encoding (extract_image). None when the page has to be rendered:
+        images covering too little of it, vector content (plans), inline or masked images,
+        encodings other than JPEG and PNG (JPEG 2000, JBIG2, TIFF...)
+        """
+        infos = page.get_image_info(xrefs=True)
+        if not infos or any(info['xref'] == 0 for info in infos):
+            return None
+        covered = sum(abs(fitz.Rect(info['bbox']) & page.rect) for info in infos)
+        if covered < min_coverage * abs(page.rect):
+            return None
+        if drawing_items(page) > MAX_VECTOR_DRAWINGS:
+            return None
+        
+        images = {}
+        for info in infos:
+            if info['xref'] not in images:
+                image = doc.extract_image(info['xref'])
+                if not image or image.get('smask') or image['ext'] not in EMBEDDED_FORMATS:
+                    return None
+                images[info['xref']] = image
+        return [(info, images[info['xref']]) for info in infos]
+
+    @staticmethod
+    def process_page_range(args):
+        """
+        Extract a contiguous range of pages with the worker's open copy of the PDF.
+        Returns (page number, records) for the pages processed successfully, each
+        record giving an output file and its position on the page (PDF points)
+        """
+        pdf_path, start, stop, output_dir, options = args
+        mode = options['mode']
+        successful = []
+        doc = _get_document(pdf_path)
+        for page_num in range(start, stop):
+            try:
+                page = doc[page_num]
+                images = None
+                if mode == 'embedded':
+                    with timer('extract'):
+                        images = FastPDFExtractor.embedded_images(doc, page, options['min_coverage'])
+                records = []
+                if images:
+                    written = {}
+                    for info, image in images:
+                        if info['xref'] not in written:
+                            # .jpg like the rest of the toolkit expects
+                            ext = 'jpg' if image['ext'] == 'jpeg' else image['ext']
+                            file_name = f"page_{page_num + 1}_img{len(written) + 1}.{ext}"
+                            with timer('write'), atomic_output(os.path.join(output_dir, file_name)) as tmp_path:
+                                with open(tmp_path, 'wb') as f:
+                                    f.write(image['image'])
+                            written[info['xref']] = file_name
+                        records.append({
+                            'page': page_num + 1, 'file': written[info['xref']], 'mode': 'embedded',
+                            'bbox': [round(v, 2) for v in info['bbox']], 'xref': info['xref'],
+                            'width': image['width'], 'height': image['height'],
+                        })
+                else:
+                    output_path, width, height, page_dpi = render_page_bounded(
+                        page, os.path.join(output_dir, f"page_{page_num + 1}.{options['image_format']}"),
+                        options['dpi'], options['max_page_bytes'], options['oversize'], options['quality'])
+                    file_name = os.path.basename(output_path)
+                    records.append({
+                        'page': page_num + 1, 'file': file_name, 'mode': 'rendered',
+                        'bbox': [round(v, 2) for v in page.rect], 'width': width, 'height': height,
+                        'dpi': page_dpi,
+                    })
+                successful.append((page_num, records))
+                count('pages')
+            except Exception as e:
+                print(f"Error processing page {page_num + 1}: {e}")
+        return successful
+
+    @staticmethod
+    def write_positions(output_dir: str, records: list):
+        """
+        Save where every extracted image sits on its page (images.json)
+        """
+        records = sorted(records, key=lambda record: (record['page'], record['file']))
+        with atomic_output(os.path.join(output_dir, POSITIONS_FILE)) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(records, f, indent=1)
+
+    @staticmethod
+    def page_chunks(pages, max_workers: int):
+        """
+        Split the page numbers into contiguous (start, stop) ranges, a few per worker
+        so that slow pages do not leave the other workers idle
+        """
+        pages = sorted(pages)
+        chunk_size = max(1, -(-len(pages) // (max_workers * 4)))
+        chunks = []
+        for page_num in pages:
+            if chunks and chunks[-1][1] == page_num and chunks[-1][1] - chunks[-1][0] < chunk_size:
+                chunks[-1][1] = page_num + 1
+            else:
+                chunks.append([page_num, page_num + 1])
+        return [tuple(chunk) for chunk in chunks]
+
     def extract_pages(self):
         """
-        Extract all pages from PDF as PNG files using multiple processes
+        Extract all pages from PDF as PNG files using multiple processes.
+        Each worker opens the PDF once and renders chunks of contiguous pages
         """
         try:
             # Create output directory
@@ -57,35 +235,119 @@ class FastPDFExtractor:
             # Open PDF to get page count
             doc = fitz.open(self.pdf_path)
             total_pages = len(doc)
-            doc.close()  # Close immediately as we'll reopen in each process
-            
-            # Prepare arguments for multiprocessing
-            process_args = []
-            for page_num in range(total_pages):
-                output_path = os.path.join(self.output_dir, f"page_{page_num + 1}.png")
-                # Pass the PDF path instead of page object
-                process_args.append((self.pdf_path, page_num, output_path, self.dpi))
+            doc.close()  # Close immediately, each worker opens its own copy once
             
             # Use ProcessPoolExecutor for parallel processing
             cpu_count = multiprocessing.cpu_count()
-            max_workers = max(1, cpu_count - 1)  # Leave one CPU core free
+            max_workers = max(1, min(cpu_count - 1, total_pages))  # Leave one CPU core free
             
-            self.logger.info(f"Starting extraction of {total_pages} pages using {max_workers} processes")
+            # Prepare page chunks for multiprocessing
+            process_args = [(self.pdf_path, start, stop, self.output_dir, self.options)
+                            for start, stop in self.page_chunks(range(total_pages), max_workers)]
             
-            with ProcessPoolExecutor(max_workers=max_workers) as executor:
-                results = list(executor.map(self.process_page, process_args))
+            self.logger.info(f"Starting extraction of {total_pages} pages in {len(process_args)} chunks using {max_workers} processes")
             
-            successful_pages = sum(results)
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(self.pdf_path,)) as executor:
+                results = [collect(packed) for packed in executor.map(
+                    with_metrics, [self.process_page_range] * len(process_args), process_args)]
+            
+            successful_pages = sum(len(pages) for pages in results)
+            if self.mode == 'embedded':
+                self.write_positions(self.output_dir, [record for pages in results
+                                                       for _, records in pages for record in records])
             self.logger.info(f"Extraction completed: {successful_pages}/{total_pages} pages processed")
             
         except Exception as e:
             self.logger.error(f"Error during extraction: {e}")
             raise
 
-def batch_process_pdfs(input_dir: str = "pdfs", output_dir: str = "extracted_pages", dpi: int = 300):
+def schedule_page_chunks(pdf_jobs: list, max_workers: int) -> list:
+    """
+    Build the task list for the shared pool: biggest PDFs first, then chunks
+    taken round-robin from every PDF so that documents are interleaved
+    """
+    queues = []
+    for pdf_path, output_path, pages in sorted(pdf_jobs, key=lambda job: len(job[2]), reverse=True):
+        if pages:
+            queues.append([(pdf_path, start, stop, output_path)
+                           for start, stop in FastPDFExtractor.page_chunks(pages, max_workers)])
+    
+    tasks = []
+    while queues:
+        for queue in queues:
+            tasks.append(queue.pop(0))
+        queues = [queue for queue in queues if queue]
+    return tasks
+
+def chunk_bytes(page_bytes: dict, start: int, stop: int) -> int:
     """
-    Process all PDFs in the input directory
+    Peak memory of a chunk: a worker renders its pages one after the other,
+    so this is the biggest page of the chunk
     """
+    return max(page_bytes.get(page_num, 0) for page_num in range(start, stop))
+
+def page_key(pdf_output_dir: str, page_num: int, mode: str, image_format: str = 'png') -> str:
+    """Manifest key of a page: its image in render mode, the page itself in embedded mode"""
+    if mode == 'embedded':
+        return os.path.join(pdf_output_dir, f"page_{page_num + 1}")
+    return os.path.join(pdf_output_dir, f"page_{page_num + 1}.{image_format}")
+
+def reuse_page(manifest: Manifest, found: tuple, pdf_output_dir: str, page_num: int) -> tuple:
+    """
+    Copy the files of an identical page already extracted (found, from
+    manifest.find) for page_num, renamed after it. Returns (outputs, records)
+    """
+    source_item, entry = found
+    copies = copy_outputs(entry['outputs'], Path(source_item).stem, f"page_{page_num + 1}", pdf_output_dir)
+    add_outputs(copies.values())
+    files = {os.path.basename(source): os.path.basename(copy) for source, copy in copies.items()}
+    records = [{**record, 'page': page_num + 1, 'file': files.get(record['file'], record['file'])}
+               for record in entry['data']['images']]
+    return list(copies.values()), records
+
+def batch_process_pdfs(input_dir: str = "pdfs", output_dir: str = "extracted_pages", dpi: int = 300,
+                       max_workers: int = None, max_inflight_pages: int = None, incremental: bool = True,
+                       mode: str = 'render', min_coverage: float = EMBEDDED_MIN_COVERAGE,
+                       max_page_pixels: int = None, max_page_bytes: int = None, oversize: str = 'bands',
+                       max_inflight_bytes: int = None, image_format: str = 'png', quality: int = 95,
+                       dedup: bool = True, report_file: str = None):
+    """
+    Process all PDFs in the input directory with one shared process pool.
+    Pages of every PDF are interleaved, biggest PDFs first, and at most
+    max_inflight_pages pages are submitted at once to keep memory bounded.
+    With incremental, pages already rendered from the same PDF content and DPI
+    (see the manifest in output_dir) are skipped. The manifest journals every
+    page as it is handed out and finished, and files are written under a
+    temporary name first: after a crash, a new run does exactly the pages left.
+    With mode='embedded', photo pages are written as their embedded images and
+    the position of every image is saved in images.json next to them.
+    Pages over the max_page_pixels / max_page_bytes budget are rendered in bands
+    or at a lower DPI (oversize), and max_inflight_bytes caps the pixmap memory
+    estimated for all the chunks being rendered at the same time.
+    image_format 'jpg' or 'webp' skips the PNG files (and their conversion).
+    With dedup, a page drawing exactly the same thing as a page already extracted
+    (same content stream, images and fonts, in any PDF, see dedup.page_digest)
+    is not rendered again: the files of the first one are copied.
+    report_file: JSON run report (time per stage, pages/s, peak memory), see instrumentation
+    """
+    metrics.reset()
+    manifest = Manifest.for_directory(output_dir)
+    max_page_bytes = page_budget(max_page_pixels, max_page_bytes)
+    params = {'dpi': dpi}
+    stage = 'render'
+    if mode == 'embedded':
+        params['min_coverage'] = min_coverage
+        stage = 'embedded'
+    if max_page_bytes:
+        params['max_page_bytes'] = max_page_bytes
+        params['oversize'] = oversize
+    if image_format != 'png':
+        params['image_format'] = image_format
+        params['quality'] = quality
+    options = render_options(dpi, mode, min_coverage, max_page_bytes, oversize, image_format, quality)
+    # Pages identiques (toutes les sources confondues), retrouvées par le contenu de la page
+    content_params = {**params, 'mode': mode}
     try:
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
@@ -98,19 +360,176 @@ def batch_process_pdfs(input_dir: str = "pdfs", output_dir: str = "extracted_pag
             return
         
         print(f"Found {len(pdf_files)} PDF files to process")
+        interrupted = manifest.unfinished(stage)
+        if interrupted:
+            print(f"Resuming: {len(interrupted)} pages left unfinished or failed by a previous run")
         
-        # Process each PDF
+        # Count the pages of each PDF still to render to schedule the work
+        pdf_jobs = []
+        pdf_hashes = {}
+        page_counts = {}
+        page_bytes = {}
+        digests = {}     # (pdf_path, page_num) -> page digest
+        first_seen = {}  # page digest -> first page with it in this run
+        duplicates = []  # pages waiting for their first occurrence
+        reused = 0
         for pdf_file in pdf_files:
             pdf_path = os.path.join(input_dir, pdf_file)
-            print(f"Processing: {pdf_file}")
+            pdf_output_dir = os.path.join(output_dir, Path(pdf_path).stem)
+            try:
+                pdf_hashes[pdf_path] = manifest.file_hash(pdf_path)
+                with fitz.open(pdf_path) as doc:
+                    total_pages = len(doc)
+                    if max_inflight_bytes:
+                        # Pixmap size known from the page rect, before rendering anything
+                        page_bytes[pdf_path] = {page_num: estimate_pixmap_bytes(doc[page_num].rect, dpi)
+                                                for page_num in range(total_pages)}
+                        if max_page_bytes:
+                            page_bytes[pdf_path] = {page_num: min(size, max_page_bytes)
+                                                    for page_num, size in page_bytes[pdf_path].items()}
+                    pages = [page_num for page_num in range(total_pages)
+                             if not (incremental and manifest.is_done(
+                                 stage, page_key(pdf_output_dir, page_num, mode, image_format),
+                                 pdf_hashes[pdf_path], params))]
+                    if dedup:
+                        cache = {}
+                        for page_num in pages:
+                            digests[(pdf_path, page_num)] = page_digest(doc, doc[page_num], cache)
+            except Exception as e:
+                print(f"Error opening {pdf_file}: {e}")
+                continue
+            os.makedirs(pdf_output_dir, exist_ok=True)
+            if interrupted:
+                remove_partial_outputs(pdf_output_dir)
+            if len(pages) < total_pages:
+                print(f"{pdf_file}: {total_pages - len(pages)}/{total_pages} pages unchanged, skipped")
             
-            extractor = FastPDFExtractor(pdf_path, output_dir, dpi)
-            extractor.extract_pages()
+            if dedup:
+                to_render = []
+                for page_num in pages:
+                    digest = digests[(pdf_path, page_num)]
+                    found = manifest.find('page', digest, content_params) if incremental else None
+                    if found:
+                        # Identical page extracted by an earlier run
+                        outputs, records = reuse_page(manifest, found, pdf_output_dir, page_num)
+                        key = page_key(pdf_output_dir, page_num, mode, image_format)
+                        manifest.record(stage, key, pdf_hashes[pdf_path], params, outputs, data={'images': records})
+                        manifest.record('page', key, digest, content_params, outputs, data={'images': records})
+                        reused += 1
+                    elif digest in first_seen:
+                        duplicates.append((pdf_path, pdf_output_dir, page_num))
+                    else:
+                        first_seen[digest] = (pdf_path, page_num)
+                        to_render.append(page_num)
+                pages = to_render
+            pdf_jobs.append((pdf_path, pdf_output_dir, pages))
+            page_counts[pdf_path] = total_pages
+        
+        total_pages = sum(len(job[2]) for job in pdf_jobs)
+        if dedup:
+            print(f"Identical pages: {reused} copied from earlier runs, {len(duplicates)} copied in this run")
+        if total_pages == 0 and not reused and not duplicates:
+            print("All pages are up to date")
+            return
+        if max_workers is None:
+            max_workers = max(1, multiprocessing.cpu_count() - 1)  # Leave one CPU core free
+        max_workers = max(1, min(max_workers, max(1, total_pages)))
+        if max_inflight_pages is None:
+            max_inflight_pages = max_workers * 16
+        
+        tasks = schedule_page_chunks(pdf_jobs, max_workers)
+        done_pages = {job[0]: 0 for job in pdf_jobs}
+        remaining_chunks = {job[0]: 0 for job in pdf_jobs}
+        for pdf_path, *_ in tasks:
+            remaining_chunks[pdf_path] += 1
+        
+        if tasks:
+            print(f"Extracting {total_pages} pages in {len(tasks)} chunks using {max_workers} processes")
+        
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            in_flight = {}
+            inflight_pages = 0
+            inflight_bytes = 0
+            next_task = 0
+            while next_task < len(tasks) or in_flight:
+                # Submit chunks until the in-flight page (and memory) budget is used
+                while next_task < len(tasks):
+                    pdf_path, start, stop, pdf_output_dir = tasks[next_task]
+                    size = chunk_bytes(page_bytes[pdf_path], start, stop) if max_inflight_bytes else 0
+                    if in_flight and (inflight_pages + (stop - start) > max_inflight_pages
+                                      or (max_inflight_bytes and inflight_bytes + size > max_inflight_bytes)):
+                        break
+                    for page_num in range(start, stop):
+                        manifest.start(stage, page_key(pdf_output_dir, page_num, mode, image_format))
+                    future = executor.submit(with_metrics, FastPDFExtractor.process_page_range,
+                                             (pdf_path, start, stop, pdf_output_dir, options))
+                    in_flight[future] = (pdf_path, start, stop, size)
+                    inflight_pages += stop - start
+                    inflight_bytes += size
+                    next_task += 1
+                
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pdf_path, start, stop, size = in_flight.pop(future)
+                    inflight_pages -= stop - start
+                    inflight_bytes -= size
+                    pdf_output_dir = os.path.join(output_dir, Path(pdf_path).stem)
+                    failed = set(range(start, stop))
+                    try:
+                        for page_num, records in collect(future.result()):
+                            failed.discard(page_num)
+                            outputs = [os.path.join(pdf_output_dir, record['file']) for record in records]
+                            key = page_key(pdf_output_dir, page_num, mode, image_format)
+                            manifest.record(stage, key, pdf_hashes[pdf_path], params, outputs,
+                                            data={'images': records})
+                            add_outputs(outputs)
+                            if dedup:
+                                manifest.record('page', key, digests[(pdf_path, page_num)], content_params,
+                                                outputs, data={'images': records})
+                            done_pages[pdf_path] += 1
+                    except Exception as e:
+                        print(f"Error processing chunk of {pdf_path}: {e}")
+                    for page_num in failed:
+                        manifest.fail(stage, page_key(pdf_output_dir, page_num, mode, image_format),
+                                      "page not extracted, see the log")
+                    remaining_chunks[pdf_path] -= 1
+                    if remaining_chunks[pdf_path] == 0:
+                        job_pages = next(len(job[2]) for job in pdf_jobs if job[0] == pdf_path)
+                        print(f"Completed: {Path(pdf_path).name} ({done_pages[pdf_path]}/{job_pages} pages)")
+        
+        # Pages identiques à une page rendue dans ce lancement : copie de ses fichiers
+        for pdf_path, pdf_output_dir, page_num in duplicates:
+            digest = digests[(pdf_path, page_num)]
+            found = manifest.find('page', digest, content_params)
+            if not found:
+                print(f"Page {page_num + 1} of {Path(pdf_path).name}: its first occurrence failed")
+                continue
+            outputs, records = reuse_page(manifest, found, pdf_output_dir, page_num)
+            key = page_key(pdf_output_dir, page_num, mode, image_format)
+            manifest.record(stage, key, pdf_hashes[pdf_path], params, outputs, data={'images': records})
+            manifest.record('page', key, digest, content_params, outputs, data={'images': records})
+        
+        if mode == 'embedded':
+            # Positions of every page, including those skipped as unchanged or copied
+            for pdf_path, pdf_output_dir, _ in pdf_jobs:
+                records = []
+                for page_num in range(page_counts[pdf_path]):
+                    entry = manifest.get(stage, page_key(pdf_output_dir, page_num, mode, image_format),
+                                         pdf_hashes[pdf_path], params)
+                    if entry:
+                        records.extend(entry['data']['images'])
+                FastPDFExtractor.write_positions(pdf_output_dir, records)
+                add_outputs([os.path.join(pdf_output_dir, POSITIONS_FILE)])
             
         print("All PDFs processed successfully")
         
     except Exception as e:
         print(f"Error in batch processing: {e}")
+    finally:
+        manifest.save()
+        if report_file:
+            metrics.write_report(report_file, command='batch_process_pdfs', dpi=dpi, mode=mode,
+                                 image_format=image_format)
 
 if __name__ == "__main__":
     batch_process_pdfs()
\ No newline at end of file
@@ -0,0 +1,246 @@
+#manifest of work already done, so re-runs only redo what changed
+import hashlib
+import json
+import os
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+MANIFEST_NAME = '.pdf2data_manifest.sqlite'
+LEGACY_MANIFEST_NAME = '.pdf2data_manifest.json'  # ancien format, importé à la première ouverture
+TMP_SUFFIX = '.tmp'
+
+# Journal states of a (stage, item)
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def file_digest(file_path: str) -> str:
+    """SHA-256 of the file content"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_output(output_path):
+    """
+    Write output_path through a temporary file renamed over it once complete,
+    so an interrupted run never leaves a half-written output under the final
+    name. Yields the temporary path: it ends with .tmp, writers have to be
+    given the format explicitly
+    """
+    tmp_path = f"{output_path}.{os.getpid()}{TMP_SUFFIX}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_partial_outputs(directory: str) -> int:
+    """Delete the temporary files left in directory by a run killed while writing"""
+    removed = 0
+    if os.path.isdir(directory):
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(TMP_SUFFIX):
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+class Manifest:
+    def __init__(self, manifest_path: str):
+        """
+        Open the job journal stored at manifest_path (SQLite, created if needed).
+        Each row is keyed by stage and item, and holds its state (running, done,
+        failed), the hash of the input file, the stage parameters and the outputs
+        it produced. Every change is committed at once, so a crashed or killed
+        run keeps everything it finished and a restart only does the rest
+        """
+        self.manifest_path = manifest_path
+        self.logger = logging.getLogger(__name__)
+        self.entries = {}  # done items only
+        self.file_hashes = {}
+        self.by_input = {}
+        self.dirty = False
+
+        Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+        legacy_path = os.path.join(os.path.dirname(manifest_path), LEGACY_MANIFEST_NAME)
+        migrate = not os.path.exists(manifest_path) and os.path.exists(legacy_path)
+        # WAL: a commit is a small append, readers never block the writer
+        self.db = sqlite3.connect(manifest_path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (stage TEXT, item TEXT, state TEXT, input TEXT, '
+                        'params TEXT, outputs TEXT, data TEXT, error TEXT, updated REAL, PRIMARY KEY (stage, item))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, '
+                        'mtime_ns INTEGER, hash TEXT)')
+        if migrate:
+            self._import_legacy(legacy_path)
+
+        for stage, item, input_hash, params, outputs, data in self.db.execute(
+                'SELECT stage, item, input, params, outputs, data FROM jobs WHERE state = ?', (DONE,)):
+            self.entries[self._key(stage, item)] = {
+                'input': input_hash, 'params': params, 'outputs': json.loads(outputs), 'data': json.loads(data),
+            }
+            self.by_input.setdefault((stage, input_hash, params), []).append(item)
+        for path, size, mtime_ns, file_hash in self.db.execute('SELECT * FROM file_hashes'):
+            self.file_hashes[path] = [size, mtime_ns, file_hash]
+
+    def _import_legacy(self, legacy_path: str):
+        """Copy a JSON manifest of an older version into the journal"""
+        try:
+            with open(legacy_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable manifest {legacy_path}: {e}")
+            return
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?)',
+                [(*key.split(':', 1), DONE, entry['input'], entry['params'], json.dumps(entry['outputs']),
+                  json.dumps(entry['data']), time.time())
+                 for key, entry in data.get('entries', {}).items()])
+            self.db.executemany('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                                [(path, *values) for path, values in data.get('file_hashes', {}).items()])
+        self.logger.info(f"Imported {legacy_path} into {self.manifest_path}")
+
+    @classmethod
+    def for_directory(cls, directory: str):
+        """Manifest stored at the root of an output directory"""
+        return cls(os.path.join(directory, MANIFEST_NAME))
+
+    def file_hash(self, file_path: str) -> str:
+        """
+        SHA-256 of the file content. The hash is reused while the file size and
+        modification time are unchanged, so unchanged inputs are not read again
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        cached = self.file_hashes.get(file_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        file_hash = file_digest(file_path)
+        self.file_hashes[file_path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        # Committed with the next change of state
+        self.db.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                        (file_path, stat.st_size, stat.st_mtime_ns, file_hash))
+        self.dirty = True
+        return file_hash
+
+    @staticmethod
+    def params_hash(params: dict) -> str:
+        """Stable hash of the stage parameters (DPI, quality, threshold, language...)"""
+        encoded = json.dumps(params or {}, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+    @staticmethod
+    def _key(stage: str, item: str) -> str:
+        return f"{stage}:{item}"
+
+    def get(self, stage: str, item: str, input_hash: str, params: dict = None):
+        """
+        Return the entry for this item if it was produced from the same input with
+        the same parameters and all of its outputs still exist, otherwise None
+        """
+        entry = self.entries.get(self._key(stage, item))
+        if not entry:
+            return None
+        if entry['input'] != input_hash or entry['params'] != self.params_hash(params):
+            return None
+        if not all(os.path.exists(output) for output in entry['outputs']):
+            return None
+        return entry
+
+    def is_done(self, stage: str, item: str, input_hash: str, params: dict = None) -> bool:
+        return self.get(stage, item, input_hash, params) is not None
+
+    def done(self, stage: str) -> dict:
+        """Entries of the items done by stage, as {item: entry}"""
+        prefix = self._key(stage, '')
+        return {key[len(prefix):]: entry for key, entry in self.entries.items() if key.startswith(prefix)}
+
+    def find(self, stage: str, input_hash: str, params: dict = None):
+        """
+        Any item already processed by stage from the same input content with the
+        same parameters, whatever its path or document, as (item, entry), or None.
+        Lets identical pages and images be processed once (see dedup)
+        """
+        for item in self.by_input.get((stage, input_hash, self.params_hash(params)), []):
+            entry = self.get(stage, item, input_hash, params)
+            if entry:
+                return item, entry
+        return None
+
+    def _set_state(self, stage: str, item: str, state: str, error: str = None):
+        self.entries.pop(self._key(stage, item), None)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, NULL, NULL, ?, ?, ?, ?)',
+                            (stage, str(item), state, '[]', '{}', error, time.time()))
+
+    def start(self, stage: str, item: str):
+        """Journal that item was handed to stage, it stays 'running' if the run dies"""
+        self._set_state(stage, item, RUNNING)
+
+    def fail(self, stage: str, item: str, error: str):
+        """Journal that stage failed on item, it is retried by the next run"""
+        self._set_state(stage, item, FAILED, str(error))
+
+    def unfinished(self, stage: str = None) -> dict:
+        """
+        Items left running (interrupted run) or failed, as {(stage, item): (state, error)}
+        """
+        query = 'SELECT stage, item, state, error FROM jobs WHERE state != ?'
+        args = (DONE,)
+        if stage is not None:
+            query += ' AND stage = ?'
+            args += (stage,)
+        return {(row[0], row[1]): (row[2], row[3]) for row in self.db.execute(query, args)}
+
+    def record(self, stage: str, item: str, input_hash: str, params: dict = None,
+               outputs: list = None, data: dict = None):
+        """Remember that item was processed by stage"""
+        params_hash = self.params_hash(params)
+        entry = {
+            'input': input_hash,
+            'params': params_hash,
+            'outputs': [str(output) for output in (outputs or [])],
+            'data': data or {},
+        }
+        self.entries[self._key(stage, item)] = entry
+        items = self.by_input.setdefault((stage, input_hash, params_hash), [])
+        if item not in items:
+            items.append(item)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?)',
+                            (stage, str(item), DONE, input_hash, params_hash, json.dumps(entry['outputs']),
+                             json.dumps(entry['data'], default=str), time.time()))
+        self.dirty = False
+
+    def rename_outputs(self, moves: dict):
+        """Follow outputs moved by a later step (old path -> new path)"""
+        moves = {str(old): str(new) for old, new in moves.items()}
+        with self.db:
+            for key, entry in self.entries.items():
+                if any(output in moves for output in entry['outputs']):
+                    entry['outputs'] = [moves.get(output, output) for output in entry['outputs']]
+                    stage, item = key.split(':', 1)
+                    self.db.execute('UPDATE jobs SET outputs = ? WHERE stage = ? AND item = ?',
+                                    (json.dumps(entry['outputs']), stage, item))
+
+    def save(self):
+        """Commit what is still pending (file hashes), state changes are committed as they happen"""
+        if self.dirty:
+            self.db.commit()
+            self.dirty = False
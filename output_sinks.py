@@ -0,0 +1,232 @@
+#streaming outputs for the extracted text rows (xlsx write-only, csv, jsonl, parquet)
+import os
+import csv
+import json
+import logging
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill, Font
+
+from instrumentation import count, timer
+from manifest import TMP_SUFFIX, atomic_output
+
+HEADERS = [
+    'Document ID', 'Page', 'Position', 'Filename',
+    'Text Content', 'Date', 'Characters', 'Words', 'Path', 'Source Folder'
+]
+COLUMN_WIDTHS = {
+    'A': 20,  # Document ID
+    'B': 8,   # Page
+    'C': 10,  # Position
+    'D': 20,  # Filename
+    'E': 50,  # Text Content
+    'F': 20,  # Date
+    'G': 12,  # Characters
+    'H': 8,   # Words
+    'I': 50,  # Path
+    'J': 15,  # Source Folder
+}
+
+
+class OutputSink:
+    def __init__(self, output_path: str, checkpoint_every: int = 100, atomic: bool = True):
+        """
+        Base class of the row outputs. Rows are written as they come and flushed
+        every checkpoint_every rows, nothing already written is ever rewritten.
+        With atomic, rows go to a temporary file renamed to output_path on close,
+        so a file under its final name is always complete (see manifest.atomic_output)
+        """
+        self.output_path = output_path
+        self.write_path = f"{output_path}.{os.getpid()}{TMP_SUFFIX}" if atomic else output_path
+        self.checkpoint_every = checkpoint_every
+        self.rows_written = 0
+        self.logger = logging.getLogger(__name__)
+
+    def write_row(self, values: list):
+        with timer('write'):
+            self._write(values)
+            self.rows_written += 1
+            if self.rows_written % self.checkpoint_every == 0:
+                self.checkpoint()
+        count('rows')
+
+    def _write(self, values: list):
+        raise NotImplementedError
+
+    def checkpoint(self):
+        """Make the rows written so far durable"""
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """
+        Give up the output after an error: the temporary file is removed and
+        nothing is published under the final name
+        """
+        raise NotImplementedError
+
+    def _publish(self):
+        """Move the complete temporary file to its final name"""
+        if self.write_path != self.output_path:
+            os.replace(self.write_path, self.output_path)
+
+    def _discard(self):
+        if self.write_path != self.output_path and os.path.exists(self.write_path):
+            os.remove(self.write_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CsvSink(OutputSink):
+    def __init__(self, output_path: str, checkpoint_every: int = 100, atomic: bool = True):
+        super().__init__(output_path, checkpoint_every, atomic)
+        # utf-8-sig so that Excel opens the accents correctly
+        self.file = open(self.write_path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(HEADERS)
+
+    def _write(self, values: list):
+        self.writer.writerow(values)
+
+    def checkpoint(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        self._publish()
+
+    def abort(self):
+        self.file.close()
+        self._discard()
+
+
+class JsonlSink(OutputSink):
+    def __init__(self, output_path: str, checkpoint_every: int = 100, atomic: bool = True):
+        super().__init__(output_path, checkpoint_every, atomic)
+        self.file = open(self.write_path, 'w', encoding='utf-8')
+
+    def _write(self, values: list):
+        self.file.write(json.dumps(dict(zip(HEADERS, values)), ensure_ascii=False, default=str) + '\n')
+
+    def checkpoint(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        self._publish()
+
+    def abort(self):
+        self.file.close()
+        self._discard()
+
+
+class ParquetSink(OutputSink):
+    def __init__(self, output_path: str, checkpoint_every: int = 1000, atomic: bool = True):
+        """
+        Each checkpoint appends one row group, so memory is bounded by checkpoint_every rows
+        """
+        super().__init__(output_path, checkpoint_every, atomic)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for the Parquet output (pip install pyarrow)")
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([(header, pyarrow.string()) for header in HEADERS])
+        self.writer = pyarrow.parquet.ParquetWriter(self.write_path, self.schema)
+        self.buffer = []
+
+    def _write(self, values: list):
+        self.buffer.append([None if value is None else str(value) for value in values])
+
+    def checkpoint(self):
+        if self.buffer:
+            columns = list(zip(*self.buffer))
+            table = self.pa.Table.from_arrays([self.pa.array(column, self.pa.string()) for column in columns],
+                                              schema=self.schema)
+            self.writer.write_table(table)
+            self.buffer = []
+
+    def close(self):
+        self.checkpoint()
+        self.writer.close()
+        self._publish()
+
+    def abort(self):
+        self.writer.close()
+        self._discard()
+
+
+class XlsxSink(OutputSink):
+    def __init__(self, output_path: str, checkpoint_every: int = 100):
+        """
+        Write-only workbook: rows are streamed to a temporary file instead of being
+        kept in memory. An xlsx file can only be produced at the end, so the rows are
+        also appended to a <output>.partial.jsonl checkpoint, removed on close and
+        kept by abort for the next run
+        """
+        super().__init__(output_path, checkpoint_every, atomic=False)
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet()
+        for column, width in COLUMN_WIDTHS.items():
+            self.ws.column_dimensions[column].width = width
+
+        # Style d'en-tête
+        header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+        header_font = Font(color="FFFFFF", bold=True)
+        header_cells = []
+        for header in HEADERS:
+            cell = WriteOnlyCell(self.ws, value=header)
+            cell.fill = header_fill
+            cell.font = header_font
+            header_cells.append(cell)
+        self.ws.append(header_cells)
+
+        self.checkpoint_path = f"{output_path}.partial.jsonl"
+        self.checkpoint_sink = JsonlSink(self.checkpoint_path, checkpoint_every, atomic=False)
+
+    def _write(self, values: list):
+        self.ws.append(values)
+        # Not write_row: the row is already timed and counted once
+        self.checkpoint_sink._write(values)
+
+    def checkpoint(self):
+        self.checkpoint_sink.checkpoint()
+
+    def close(self):
+        self.checkpoint_sink.close()
+        with timer('write'), atomic_output(self.output_path) as tmp_path:
+            self.wb.save(tmp_path)
+        os.remove(self.checkpoint_path)
+
+    def abort(self):
+        # Le checkpoint reste : les lignes déjà écrites restent lisibles après l'erreur
+        self.checkpoint_sink.abort()
+        # Ferme le fichier temporaire de la feuille, le classeur n'est jamais enregistré
+        self.ws.close()
+
+
+SINKS = {
+    'xlsx': XlsxSink,
+    'csv': CsvSink,
+    'jsonl': JsonlSink,
+    'parquet': ParquetSink,
+}
+
+
+def open_sink(output_path: str, output_format: str = None, **kwargs) -> OutputSink:
+    """
+    Open the sink matching output_format, or the output file extension
+    """
+    output_format = (output_format or os.path.splitext(output_path)[1].lstrip('.') or 'xlsx').lower()
+    if output_format not in SINKS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {', '.join(SINKS)}")
+    return SINKS[output_format](output_path, **kwargs)
@@ -0,0 +1,175 @@
+#sort extracted pages into doubles_images_pages / une_image_page / plans without a human
+import fitz
+import os
+import re
+import csv
+import shutil
+from pathlib import Path
+from PIL import Image
+
+from extract_double_image_jpg import detect_split_points_batch
+from main import MAX_VECTOR_DRAWINGS, drawing_items
+from manifest import Manifest
+from fs_index import add_outputs, get_index, moved
+
+CATEGORIES = ('doubles_images_pages', 'une_image_page', 'plans')
+THUMBNAIL_DPI = 24          # enough for the whitespace profile
+MIN_IMAGE_AREA = 0.08       # images smaller than this share of the page are ignored (logos...)
+REVIEW_CONFIDENCE = 0.7     # pages below this confidence are flagged for a human
+MIN_TEXT_CHARS = 500        # a page without images holding this much text is a text page, not photos
+BATCH_PAGES = 64            # thumbnails kept in memory at once
+REPORT_FILE = 'classification_report.csv'
+
+
+def page_features(page) -> dict:
+    """
+    Cheap features read from the PDF objects of the page, no rendering
+    """
+    page_area = abs(page.rect)
+    boxes = []
+    for info in page.get_image_info():
+        box = fitz.Rect(info['bbox']) & page.rect
+        if abs(box) >= MIN_IMAGE_AREA * page_area and not any(abs(box & other) > 0.5 * abs(box) for other in boxes):
+            boxes.append(box)
+    return {
+        'images': len(boxes),
+        'image_coverage': round(sum(abs(box) for box in boxes) / page_area, 3),
+        'drawings': drawing_items(page),
+        'text_chars': len(page.get_text().strip()),
+    }
+
+
+def classify_features(features: dict, splits: list) -> tuple:
+    """
+    (category, confidence) of a page from its PDF features and the whitespace
+    splits found on its thumbnail (see detect_split_points_batch). The splits
+    only count on pages holding images
+    """
+    images, coverage, drawings = features['images'], features['image_coverage'], features['drawings']
+
+    if drawings >= MAX_VECTOR_DRAWINGS and coverage < 0.2:
+        return 'plans', min(1.0, 0.6 + 0.4 * drawings / (4 * MAX_VECTOR_DRAWINGS))
+    if images >= 2:
+        return 'doubles_images_pages', 0.95 if splits else 0.75
+    if images == 1:
+        if splits and coverage > 0.8:
+            # Scanned page: one image holding the whole page, the profile shows several photos
+            return 'doubles_images_pages', 0.6
+        return 'une_image_page', 0.6 if splits else 0.9
+    if drawings >= MAX_VECTOR_DRAWINGS:
+        return 'plans', 0.6
+    # No images: whitespace splits are only paragraph gaps, the page is read whole
+    if features['text_chars'] >= MIN_TEXT_CHARS:
+        return 'une_image_page', 0.8
+    if drawings:
+        return 'plans', 0.4
+    return 'une_image_page', 0.3
+
+
+def render_thumbnail(page, dpi: int = THUMBNAIL_DPI):
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), alpha=False, colorspace=fitz.csGRAY)
+    return Image.frombytes('L', (pix.width, pix.height), pix.samples)
+
+
+def classify_document(pdf_path: str) -> list:
+    """
+    Classify every page of the PDF. Thumbnails are rendered in batches and the
+    split detection runs once per batch. Returns one dict per page with the
+    features, the category, the confidence and whether it needs a review
+    """
+    results = []
+    with fitz.open(pdf_path) as doc:
+        for start in range(0, len(doc), BATCH_PAGES):
+            pages = [doc[page_num] for page_num in range(start, min(start + BATCH_PAGES, len(doc)))]
+            layouts = detect_split_points_batch([render_thumbnail(page) for page in pages])
+            for page, (split_axis, splits) in zip(pages, layouts):
+                features = page_features(page)
+                category, confidence = classify_features(features, splits)
+                results.append({
+                    'document': Path(pdf_path).stem,
+                    'page': page.number + 1,
+                    'category': category,
+                    'confidence': round(confidence, 2),
+                    'needs_review': confidence < REVIEW_CONFIDENCE,
+                    'splits': len(splits),
+                    **features,
+                })
+    return results
+
+
+def route_pages(pages_dir: str, classifications: list) -> dict:
+    """
+    Move the extracted files of each page (page_N.png, page_N_imgK.jpg...) into the
+    category folder expected by the downstream scripts. Embedded images are
+    already one file per image, so a double page made of them goes to une_image_page.
+    Returns the moves (old path -> new path)
+    """
+    categories = {result['page']: result['category'] for result in classifications}
+    moves = {}
+    for file_name in get_index(pages_dir).files(pages_dir):
+        match = re.match(r'page_(\d+)(_img\d+)?\.', file_name)
+        if not match or int(match.group(1)) not in categories:
+            continue
+        category = categories[int(match.group(1))]
+        if match.group(2) and category == 'doubles_images_pages':
+            category = 'une_image_page'
+        os.makedirs(os.path.join(pages_dir, category), exist_ok=True)
+        old_path = os.path.join(pages_dir, file_name)
+        new_path = os.path.join(pages_dir, category, file_name)
+        shutil.move(old_path, new_path)
+        moves[old_path] = new_path
+    return moves
+
+
+def write_report(report_path: str, classifications: list):
+    fields = ['document', 'page', 'category', 'confidence', 'needs_review', 'splits',
+              'images', 'image_coverage', 'drawings', 'text_chars']
+    with open(report_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(classifications)
+
+
+def classify_pdfs(input_dir: str = "pdfs", pages_dir: str = "extracted_pages", report_file: str = None):
+    """
+    Classify the pages of every PDF, route the files extracted by main.py
+    (pages_dir/<pdf name>/) into category folders and write the confidence report.
+    Only pages flagged needs_review have to be checked by hand
+    """
+    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+    if not pdf_files:
+        print("No PDF files found in the input directory")
+        return []
+
+    manifest = Manifest.for_directory(pages_dir)
+    get_index(pages_dir)  # one scan for every document, not one per document folder
+    classifications = []
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(input_dir, pdf_file)
+        try:
+            results = classify_document(pdf_path)
+        except Exception as e:
+            print(f"Error classifying {pdf_file}: {e}")
+            continue
+        classifications.extend(results)
+
+        document_dir = os.path.join(pages_dir, Path(pdf_path).stem)
+        if os.path.isdir(document_dir):
+            moves = route_pages(document_dir, results)
+            manifest.rename_outputs(moves)
+            moved(moves)
+            print(f"{pdf_file}: {len(results)} pages classified, {len(moves)} files routed")
+    manifest.save()
+
+    report_path = report_file or os.path.join(pages_dir, REPORT_FILE)
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    write_report(report_path, classifications)
+    add_outputs([report_path])
+
+    to_review = sum(result['needs_review'] for result in classifications)
+    print(f"Report saved: {report_path} ({to_review}/{len(classifications)} pages to review)")
+    return classifications
+
+
+if __name__ == "__main__":
+    classify_pdfs()
@@ -0,0 +1,404 @@
+#one command for the whole chain: render -> convert -> split -> crop -> ocr, as concurrent stages
+import os
+import shutil
+import queue
+import argparse
+import logging
+import threading
+import multiprocessing
+from dataclasses import dataclass, replace
+from functools import partial
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from main import FastPDFExtractor, EMBEDDED_MIN_COVERAGE, _get_document, _init_worker, render_options
+from convertPNGtoJPG import convert_file
+from extract_double_image_jpg import ImageSplitter, configure_logging
+from extract_images_completly import ImageContentExtractor
+from extract_text_from_img_to_xls import (TEXT_LAYER_MIN_QUALITY, _init_ocr_worker, make_row, ocr_file,
+                                          parse_filename, part_fractions, text_from_layer, text_layer_quality)
+from output_sinks import open_sink
+from dedup import copy_outputs, image_digest
+from instrumentation import PROFILE_ENV, collect, count, metrics, profiled, timer, with_metrics
+from page_classifier import REPORT_FILE, classify_document, write_report
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 16  # items waiting between two stages, a full queue blocks the stage before it
+_DONE = None     # end of stream marker passed from stage to stage
+
+
+@dataclass
+class PageJob:
+    """
+    One page (then one image of the page) travelling through the stages
+    """
+    pdf_path: str
+    page_number: int
+    category: str
+    path: str = None
+    position: str = ''
+    source_folder: str = ''
+    fraction: tuple = None
+    text: str = None
+
+    @property
+    def pdf_name(self):
+        return Path(self.pdf_path).stem
+
+
+class Stage:
+    def __init__(self, name: str, func, workers: int = 1, processes: bool = False,
+                 initializer=None, initargs: tuple = (), key=None, reuse=None):
+        """
+        One step of the chain. func takes a job and returns the jobs for the next
+        stage (none to drop it, several when a page is split). With processes,
+        func runs in a pool of `workers` processes (CPU bound work), otherwise
+        in `workers` threads (I/O, subprocesses).
+        key(job) gives the content key of a job (None: always processed): a job
+        with the key of a job already processed gets reuse(job, first job, its
+        results) instead of func
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.key = key
+        self.reuse = reuse
+
+
+def run_stages(source, stages: list, queue_size: int = QUEUE_SIZE):
+    """
+    Run the stages concurrently, linked by bounded queues: a stage blocks when
+    the next one is behind (backpressure), so memory stays bounded while every
+    stage keeps working. Yields the jobs coming out of the last stage as soon
+    as they are ready. A job failing in a stage is logged and dropped
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    remaining = [stage.workers for stage in stages]
+    lock = threading.Lock()
+    # Per stage: content key -> [done event, first job, its results (None when it failed)]
+    processed = [{} for _ in stages]
+
+    # spawn: forking a process that already runs threads can deadlock the child
+    context = multiprocessing.get_context('spawn')
+    executors = [ProcessPoolExecutor(max_workers=stage.workers, mp_context=context,
+                                     initializer=stage.initializer, initargs=stage.initargs)
+                 if stage.processes else None for stage in stages]
+
+    def feed():
+        try:
+            for job in source:
+                queues[0].put(job)
+        except Exception as e:
+            logger.error(f"Error listing the pages: {e}")
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_DONE)
+
+    def work(index):
+        stage, executor = stages[index], executors[index]
+        inbox, outbox = queues[index], queues[index + 1]
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            entry, owner = None, False
+            try:
+                key = stage.key(job) if stage.key else None
+                if key is not None:
+                    with lock:
+                        entry = processed[index].get(key)
+                        owner = entry is None
+                        if owner:
+                            entry = processed[index][key] = [threading.Event(), job, None]
+                    if not owner:
+                        # Same content as an earlier job: wait for it and reuse its results
+                        entry[0].wait()
+                if entry is not None and not owner and entry[2] is not None:
+                    results = stage.reuse(job, entry[1], entry[2])
+                    count(f"{stage.name}_reused")
+                elif executor is not None:
+                    results = collect(executor.submit(with_metrics, stage.func, job).result())
+                else:
+                    results = stage.func(job)
+                if owner:
+                    entry[2] = results
+            except Exception as e:
+                logger.error(f"{stage.name} failed for page {job.page_number} of {job.pdf_name}: {e}")
+                continue
+            finally:
+                if owner:
+                    entry[0].set()
+            count(f"{stage.name}_done")
+            for result in results:
+                outbox.put(result)
+
+        # The last worker of the stage closes the stream of the next one
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            for _ in range(stages[index + 1].workers if index + 1 < len(stages) else 1):
+                outbox.put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.extend(threading.Thread(target=work, args=(index,), name=f"{stage.name}-{n}", daemon=True)
+                       for n in range(stage.workers))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                break
+            yield job
+    finally:
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+
+def page_jobs(input_dir: str, classifications: list):
+    """
+    Classify every PDF of input_dir and yield one job per page. The results
+    are also appended to classifications for the report
+    """
+    pdf_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.pdf'))
+    logger.info(f"Found {len(pdf_files)} PDF files to process")
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(input_dir, pdf_file)
+        try:
+            with timer('classify'):
+                results = classify_document(pdf_path)
+        except Exception as e:
+            logger.error(f"Error classifying {pdf_file}: {e}")
+            continue
+        classifications.extend(results)
+        for result in results:
+            yield PageJob(pdf_path, result['page'], result['category'])
+
+
+def render_job(job: PageJob, pages_dir: str, options: dict):
+    """Render the page into pages_dir/<document>/<category>/ (see FastPDFExtractor)"""
+    document_dir = os.path.join(pages_dir, job.pdf_name)
+    output_dir = os.path.join(document_dir, job.category)
+    os.makedirs(output_dir, exist_ok=True)
+    pages = FastPDFExtractor.process_page_range((job.pdf_path, job.page_number - 1, job.page_number,
+                                                 output_dir, options))
+    if not pages:
+        raise RuntimeError("rendering failed")
+
+    jobs = []
+    for file_name in dict.fromkeys(record['file'] for record in pages[0][1]):
+        path = os.path.join(output_dir, file_name)
+        category = job.category
+        if '_img' in file_name and category == 'doubles_images_pages':
+            # Embedded images are already one file per image, nothing to split
+            category = 'une_image_page'
+            os.makedirs(os.path.join(document_dir, category), exist_ok=True)
+            path = shutil.move(path, os.path.join(document_dir, category, file_name))
+        jobs.append(replace(job, category=category, path=path))
+    return jobs
+
+
+def convert_job(job: PageJob, images_dir: str):
+    """PNG/WebP -> JPEG into images_dir/<document>/<category>/, JPEG files are copied (see convertPNGtoJPG)"""
+    output_dir = os.path.join(images_dir, job.pdf_name, job.category)
+    os.makedirs(output_dir, exist_ok=True)
+    file_name = os.path.basename(job.path)
+    if not file_name.lower().endswith(('.jpg', '.jpeg')):
+        file_name = os.path.splitext(file_name)[0] + '.jpg'
+    output_path = os.path.join(output_dir, file_name)
+    with timer('convert'):
+        convert_file(job.path, output_path)
+    return [replace(job, path=output_path)]
+
+
+def split_job(job: PageJob):
+    """
+    Split double pages into doubles_images_pages/split_images, pass single
+    image pages through and leave the plans out
+    """
+    if job.category == 'plans':
+        return []
+    if job.category != 'doubles_images_pages':
+        return [replace(job, source_folder=job.category)]
+
+    output_dir = os.path.join(os.path.dirname(job.path), 'split_images')
+    splitter = ImageSplitter(job.path, output_dir)
+    outputs = splitter.split_and_save_image()
+    images = [(path, os.path.basename(path), job.pdf_name, job.category) for path in outputs]
+    fractions = part_fractions(images, dict.fromkeys(map(os.path.abspath, outputs), splitter.split_axis))
+    return [replace(job, path=path, position=parse_filename(filename)[1], source_folder=job.category,
+                    fraction=fractions.get(path))
+            for path, filename, *_ in images]
+
+
+def split_key(job: PageJob):
+    """Content key of the double pages, the other pages are not split"""
+    return image_digest(job.path) if job.category == 'doubles_images_pages' else None
+
+
+def reuse_split(job: PageJob, first: PageJob, results: list):
+    """Parts of an identical page already split, copied and renamed after this page"""
+    copies = copy_outputs([result.path for result in results], Path(first.path).stem, Path(job.path).stem,
+                          os.path.join(os.path.dirname(job.path), 'split_images'))
+    return [replace(job, path=copies[result.path], position=result.position, source_folder=result.source_folder,
+                    fraction=result.fraction)
+            for result in results]
+
+
+_crop_extractor = None
+
+def crop_job(job: PageJob):
+    """Save the image regions without text into image_sans_texte, the job goes on to the OCR"""
+    global _crop_extractor
+    if _crop_extractor is None:
+        _crop_extractor = ImageContentExtractor()
+    folder = _crop_extractor.create_extraction_subfolder(os.path.dirname(job.path))
+    _crop_extractor.extract_image_content(job.path, folder)
+    return [job]
+
+
+def ocr_job(job: PageJob, text_layer: bool, min_quality: float):
+    """Text of the image: the PDF text layer when it is good enough, Tesseract otherwise"""
+    if text_layer:
+        try:
+            text = text_from_layer(_get_document(job.pdf_path), job.page_number, job.fraction)
+            if text_layer_quality(text) >= min_quality:
+                return [replace(job, text=text)]
+        except Exception as e:
+            logger.warning(f"Error reading the text layer of {job.path}: {e}")
+    text, error = ocr_file(job.path)
+    if error is not None:
+        raise RuntimeError(error)
+    return [replace(job, text=text)]
+
+
+def ocr_key(job: PageJob):
+    """Content key of the image to read"""
+    return image_digest(job.path)
+
+
+def reuse_text(job: PageJob, first: PageJob, results: list):
+    """Text of an identical image already read"""
+    return [replace(job, text=results[0].text)]
+
+
+def build_stages(args) -> list:
+    """The stages selected on the command line, with their worker counts"""
+    stages = [
+        Stage('render', partial(render_job, pages_dir=args.pages_dir,
+                                options=render_options(args.dpi, args.mode, args.min_coverage, args.max_page_bytes,
+                                                       image_format=args.image_format, quality=args.quality)),
+              args.render_workers, processes=True, initializer=_init_worker),
+        Stage('convert', partial(convert_job, images_dir=args.images_dir), args.convert_workers),
+        Stage('split', split_job, args.split_workers, processes=True, initializer=configure_logging,
+              key=None if args.no_dedup else split_key, reuse=reuse_split),
+    ]
+    if not args.no_crop:
+        stages.append(Stage('crop', crop_job, args.crop_workers, processes=True))
+    if not args.no_ocr:
+        stages.append(Stage('ocr', partial(ocr_job, text_layer=not args.no_text_layer, min_quality=args.min_quality),
+                            args.ocr_workers, processes=True, initializer=_init_ocr_worker,
+                            initargs=(args.lang, not args.no_ocr_regions),
+                            key=None if args.no_dedup else ocr_key, reuse=reuse_text))
+    return stages
+
+
+def parse_args(argv=None):
+    cpu_count = multiprocessing.cpu_count()
+    parser = argparse.ArgumentParser(
+        description="Extract the images and the text of the PDFs: render, convert, split, crop "
+                    "and OCR run at the same time, each stage with its own workers"
+    )
+    parser.add_argument('input_dir', nargs='?', default='pdfs', help="folder of the PDF files")
+    parser.add_argument('--pages-dir', default='extracted_pages', help="rendered pages")
+    parser.add_argument('--images-dir', default='output_images', help="JPEG pages, split images and crops")
+    parser.add_argument('-o', '--output', default='extracted_text.xlsx', help="text output file")
+    parser.add_argument('--format', choices=['xlsx', 'csv', 'jsonl', 'parquet'],
+                        help="output format (default: from the output file extension)")
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--mode', choices=['render', 'embedded'], default='render',
+                        help="embedded: write the images stored in the PDF instead of rendering photo pages")
+    parser.add_argument('--min-coverage', type=float, default=EMBEDDED_MIN_COVERAGE)
+    parser.add_argument('--max-page-bytes', type=int, help="render bigger pages in bands")
+    parser.add_argument('--image-format', choices=['png', 'jpg', 'webp'], default='jpg',
+                        help="format of the rendered pages (jpg: no PNG to convert afterwards)")
+    parser.add_argument('--quality', type=int, default=95, help="JPEG/WebP quality of the rendered pages")
+    parser.add_argument('--lang', default='fra', help="Tesseract language")
+    parser.add_argument('--min-quality', type=float, default=TEXT_LAYER_MIN_QUALITY)
+    parser.add_argument('--no-text-layer', action='store_true', help="always OCR, never read the PDF text")
+    parser.add_argument('--no-ocr-regions', action='store_true', help="OCR the whole image, not only its text regions")
+    parser.add_argument('--no-crop', action='store_true', help="do not save the images without text")
+    parser.add_argument('--no-ocr', action='store_true', help="stop after the images")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="split and read identical images again instead of reusing the first result")
+    parser.add_argument('--render-workers', type=int, default=max(1, cpu_count // 4))
+    parser.add_argument('--convert-workers', type=int, default=2)
+    parser.add_argument('--split-workers', type=int, default=max(1, cpu_count // 4))
+    parser.add_argument('--crop-workers', type=int, default=max(1, cpu_count // 4))
+    parser.add_argument('--ocr-workers', type=int, default=max(1, cpu_count // 2))
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="jobs waiting between two stages")
+    parser.add_argument('--report', help="JSON run report: time per stage, pages/s, peak memory per worker")
+    parser.add_argument('--profile', metavar='DIR', help="cProfile stats of every process in DIR (<pid>.prof)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.reset()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    if args.profile:
+        # Read by the workers too, they inherit the environment
+        os.environ[PROFILE_ENV] = args.profile
+
+    with profiled():
+        processed = run(args)
+    if args.report:
+        metrics.write_report(args.report, command='pdf2data', input_dir=args.input_dir, images=processed,
+                             workers={stage.name: stage.workers for stage in build_stages(args)})
+    return processed
+
+
+def run(args) -> int:
+    classifications = []
+    jobs = run_stages(page_jobs(args.input_dir, classifications), build_stages(args), args.queue_size)
+
+    # Rows are written as the images come out of the chain, not in page order
+    processed = 0
+    sink = None if args.no_ocr else open_sink(args.output, args.format)
+    try:
+        for job in jobs:
+            if sink is not None:
+                filename = os.path.basename(job.path)
+                sink.write_row(make_row(job.pdf_name, str(job.page_number), job.position, filename,
+                                        job.text, job.path, job.source_folder))
+            processed += 1
+            print(f"Processed: {os.path.basename(job.path)} of {job.pdf_name}")
+    except BaseException:
+        # Interrupted: nothing half written under the output name
+        if sink is not None:
+            sink.abort()
+        raise
+    if sink is not None:
+        sink.close()
+        print(f"Output file saved: {args.output}")
+
+    if classifications:
+        os.makedirs(args.pages_dir, exist_ok=True)
+        write_report(os.path.join(args.pages_dir, REPORT_FILE), classifications)
+    print(f"{processed} images processed")
+    return processed
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#single pass pdf -> split/crop/ocr pipeline, pages stay in memory (no intermediate PNG/JPG)
+import fitz
+import os
+from pathlib import Path
+import logging
+from dataclasses import dataclass
+from PIL import Image
+import numpy as np
+import cv2
+
+from extract_double_image_jpg import ImageSplitter
+from extract_images_completly import ImageContentExtractor
+from extract_text_from_img_to_xls import make_row, ocr_image
+from output_sinks import open_sink
+from page_classifier import classify_document
+from bounded_render import fit_dpi
+from manifest import atomic_output
+from fs_index import add_outputs
+from instrumentation import count, metrics, timer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PageImage:
+    """
+    One page (or one part of a split page) travelling through the pipeline
+    """
+    pdf_name: str
+    page_number: int
+    image: Image.Image
+    position: str = ''
+    source_folder: str = 'une_image_page'
+    content: np.ndarray = None
+    text: str = None
+
+    @property
+    def filename(self):
+        suffix = f"_{self.position}" if self.position else ''
+        return f"page_{self.page_number}{suffix}.jpg"
+
+
+def render_page(page, dpi: int = 300, max_page_bytes: int = None):
+    """
+    Render a fitz page straight into a PIL image, without going through a file.
+    The image stays in memory, so a page over max_page_bytes gets a lower DPI
+    """
+    if max_page_bytes:
+        dpi = fit_dpi(page.rect, dpi, max_page_bytes)
+    matrix = fitz.Matrix(dpi/72, dpi/72)
+    with timer('render'):
+        pix = page.get_pixmap(matrix=matrix, alpha=False)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def render_pages(pdf_path: str, dpi: int = 300, max_page_bytes: int = None):
+    """
+    Render every page of the PDF once, yielding in-memory images
+    """
+    pdf_name = Path(pdf_path).stem
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in range(len(doc)):
+            count('pages')
+            yield PageImage(pdf_name, page_num + 1, render_page(doc[page_num], dpi, max_page_bytes))
+    finally:
+        doc.close()
+
+
+def _should_split(split, page_number: int) -> bool:
+    if callable(split):
+        return split(page_number)
+    if isinstance(split, bool):
+        return split
+    return page_number in split
+
+
+def split_pages(items, split=False):
+    """
+    Split the selected pages into their images (top/bottom, left/right or
+    part1..partN, see ImageSplitter.split_image). `split` is a bool, a
+    collection of page numbers (1-based) or a callable taking the page number
+    (run_pipeline also accepts 'auto', see page_classifier)
+    """
+    splitter = ImageSplitter('', '')
+    for item in items:
+        if not _should_split(split, item.page_number):
+            yield item
+            continue
+        try:
+            with timer('split'):
+                parts = splitter.split_image(item.image)
+        except Exception as e:
+            logger.error(f"Error splitting page {item.page_number} of {item.pdf_name}: {e}")
+            yield item
+            continue
+        for position, image in parts:
+            yield PageImage(item.pdf_name, item.page_number, image,
+                            position=position, source_folder='doubles_images_pages')
+
+
+def crop_images(items, extractor: ImageContentExtractor = None):
+    """
+    Attach the image content without text (same crop as ImageContentExtractor)
+    """
+    extractor = extractor or ImageContentExtractor()
+    for item in items:
+        try:
+            bgr = cv2.cvtColor(np.asarray(item.image), cv2.COLOR_RGB2BGR)
+            item.content = extractor.crop_image_content(bgr)
+        except Exception as e:
+            logger.error(f"Error cropping {item.filename} of {item.pdf_name}: {e}")
+        yield item
+
+
+def ocr_pages(items, lang: str = 'fra'):
+    """
+    OCR each image while it is still decoded in memory
+    """
+    for item in items:
+        try:
+            with timer('ocr'):
+                item.text = ocr_image(item.image, lang=lang)
+        except Exception as e:
+            logger.error(f"Error during OCR of {item.filename} of {item.pdf_name}: {e}")
+        yield item
+
+
+def write_outputs(items, output_dir: str, sink=None, save_splits: bool = True):
+    """
+    Write only the final artifacts: split images, image_sans_texte crops and text rows
+    """
+    for item in items:
+        doc_dir = os.path.join(output_dir, item.pdf_name)
+        file_path = ''
+        if item.position and save_splits:
+            split_dir = os.path.join(doc_dir, 'doubles_images_pages', 'split_images')
+            os.makedirs(split_dir, exist_ok=True)
+            file_path = os.path.join(split_dir, item.filename)
+            with timer('encode'), atomic_output(file_path) as tmp_path:
+                item.image.save(tmp_path, 'JPEG', quality=95)
+            add_outputs([file_path])
+
+        if item.content is not None:
+            if item.position:
+                content_dir = os.path.join(doc_dir, 'doubles_images_pages', 'split_images', 'image_sans_texte')
+            else:
+                content_dir = os.path.join(doc_dir, 'une_image_page', 'image_sans_texte')
+            os.makedirs(content_dir, exist_ok=True)
+            with timer('encode'), atomic_output(os.path.join(content_dir, item.filename)) as tmp_path:
+                cv2.imencode('.jpg', item.content)[1].tofile(tmp_path)
+            add_outputs([os.path.join(content_dir, item.filename)])
+
+        if sink is not None and item.text is not None:
+            sink.write_row(make_row(item.pdf_name, str(item.page_number), item.position, item.filename,
+                                    item.text, file_path, item.source_folder))
+
+        yield item
+
+
+def run_pipeline(pdf_path: str, output_dir: str = "output_images", dpi: int = 300, split=False,
+                 crop: bool = True, ocr: bool = True, lang: str = 'fra', sink=None, max_page_bytes: int = None):
+    """
+    Render, split, crop and OCR a PDF in a single pass. Each page is rendered once
+    and handed from stage to stage as a generator chain. OCR rows go to sink
+    (see output_sinks). Returns the number of images produced
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    items = render_pages(pdf_path, dpi, max_page_bytes)
+    if split == 'auto':
+        # Split the pages the classifier sees as double pages and leave the plans out
+        classifications = classify_document(pdf_path)
+        split = {result['page'] for result in classifications if result['category'] == 'doubles_images_pages'}
+        plans = {result['page'] for result in classifications if result['category'] == 'plans'}
+        items = (item for item in items if item.page_number not in plans)
+    items = split_pages(items, split)
+    if crop:
+        items = crop_images(items)
+    if ocr:
+        items = ocr_pages(items, lang)
+
+    count = 0
+    for _ in write_outputs(items, output_dir, sink if ocr else None):
+        count += 1
+
+    logger.info(f"Pipeline completed for {pdf_path}: {count} images")
+    return count
+
+
+def batch_run_pipeline(input_dir: str = "pdfs", output_dir: str = "output_images",
+                       output_file: str = "extracted_text.xlsx", output_format: str = None,
+                       ocr: bool = True, report_file: str = None, **kwargs):
+    """
+    Run the single-pass pipeline over all PDFs in the input directory,
+    collecting the OCR text of every PDF into one output file.
+    report_file: JSON run report, see instrumentation
+    """
+    metrics.reset()
+    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+    if not pdf_files:
+        print("No PDF files found in the input directory")
+        return
+
+    print(f"Found {len(pdf_files)} PDF files to process")
+    sink = open_sink(output_file, output_format) if ocr else None
+    try:
+        for pdf_file in pdf_files:
+            print(f"Processing: {pdf_file}")
+            try:
+                run_pipeline(os.path.join(input_dir, pdf_file), output_dir, ocr=ocr, sink=sink, **kwargs)
+            except Exception as e:
+                print(f"Error processing {pdf_file}: {e}")
+    except BaseException:
+        if sink is not None:
+            sink.abort()
+        raise
+    else:
+        if sink is not None:
+            sink.close()
+            print(f"Output file saved: {output_file}")
+    finally:
+        if report_file:
+            metrics.write_report(report_file, command='batch_run_pipeline')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    batch_run_pipeline()
@@ -0,0 +1,44 @@
+#rendering in bands gives the same pixels as a direct render
+import sys
+from pathlib import Path
+
+import fitz
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bounded_render import pixmap_size, render_in_bands
+
+DPI = 150
+
+
+def photo_page(doc):
+    """A4 page with a gradient photo, a line drawing and some text"""
+    page = doc.new_page(width=595, height=842)
+    y, x = np.mgrid[0:300, 0:400]
+    pixels = np.stack([x * 255 // 400, y * 255 // 300, (x + y) * 127 // 700], axis=-1).astype(np.uint8)
+    page.insert_image(fitz.Rect(60, 60, 535, 420), pixmap=fitz.Pixmap(fitz.csRGB, 400, 300, pixels.tobytes(), False))
+    page.draw_line((60, 450), (535, 780), color=(0, 0, 0), width=1.5)
+    page.insert_textbox(fitz.Rect(60, 460, 535, 780), 'Plan du rez-de-chaussée, état ancien. ' * 20, fontsize=10)
+    return page
+
+
+def test_bands_match_a_direct_render(tmp_path):
+    output = tmp_path / 'page_1.png'
+    with fitz.open() as doc:
+        page = photo_page(doc)
+        # Bandes de 50 lignes : la page est rendue en 36 morceaux
+        size = render_in_bands(page, str(output), DPI, band_bytes=50 * pixmap_size(page.rect, DPI)[0] * 3)
+        zoom = DPI / 72
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False, colorspace=fitz.csRGB)
+        direct = np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, 3)
+
+    with Image.open(output) as image:
+        banded = np.asarray(image.convert('RGB'))
+    assert size == (pix.width, pix.height) == (banded.shape[1], banded.shape[0])
+    # Anticrénelage du texte et des traits recalculé par bande : quelques arrondis près
+    difference = np.abs(banded.astype(int) - direct.astype(int))
+    assert difference.mean() < 0.05
+    assert difference.max() <= 32
+    assert not list(tmp_path.glob('*.tmp'))
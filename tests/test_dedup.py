@@ -0,0 +1,46 @@
+#content keys of pages and images, whatever their document or path
+import shutil
+import sys
+from pathlib import Path
+
+import fitz
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from dedup import image_digest, page_digest
+from synthetic_pdfs import make_pdf
+
+
+def test_same_page_in_two_documents_has_the_same_digest(tmp_path):
+    # Même graine : la première page des deux documents est identique, la seconde diffère
+    first = make_pdf(str(tmp_path / 'first.pdf'), 'double_image', pages=2)
+    second = make_pdf(str(tmp_path / 'second.pdf'), 'double_image', pages=1)
+    with fitz.open(first) as doc, fitz.open(second) as other:
+        cache = {}
+        digests = [page_digest(doc, page, cache) for page in doc]
+        assert page_digest(other, other[0]) == digests[0]
+        assert digests[1] != digests[0]
+        # Le cache ne change pas le résultat
+        assert page_digest(doc, doc[1]) == digests[1]
+
+
+def test_text_change_changes_the_digest(tmp_path):
+    pdf_path = make_pdf(str(tmp_path / 'text.pdf'), 'text', pages=1)
+    with fitz.open(pdf_path) as doc:
+        before = page_digest(doc, doc[0])
+        doc[0].insert_text((60, 820), 'page 1', fontsize=8)
+        assert page_digest(doc, doc[0]) != before
+
+
+def test_image_digest_follows_the_bytes(tmp_path):
+    (tmp_path / 'a').mkdir()
+    first = tmp_path / 'a' / 'page_1.jpg'
+    first.write_bytes(b'\xff\xd8 same bytes')
+    copy = tmp_path / 'page_7.jpg'
+    shutil.copy(first, copy)
+    other = tmp_path / 'page_2.jpg'
+    other.write_bytes(b'\xff\xd8 other bytes')
+
+    assert image_digest(str(first)) == image_digest(str(copy))
+    assert image_digest(str(first)) != image_digest(str(other))
@@ -0,0 +1,67 @@
+#manifest journal: resume after a crash, import of the old JSON manifest
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from manifest import FAILED, LEGACY_MANIFEST_NAME, RUNNING, Manifest
+
+PARAMS = {'lang': 'fra'}
+
+
+def test_record_survives_a_new_run(tmp_path):
+    output = tmp_path / 'page_1.txt'
+    output.write_text('text')
+    manifest = Manifest.for_directory(str(tmp_path))
+    manifest.record('ocr', 'page_1.jpg', 'hash1', PARAMS, [output], data={'text': 'text'})
+    manifest.save()
+
+    reopened = Manifest.for_directory(str(tmp_path))
+    assert reopened.is_done('ocr', 'page_1.jpg', 'hash1', PARAMS)
+    assert reopened.get('ocr', 'page_1.jpg', 'hash1', PARAMS)['data'] == {'text': 'text'}
+    assert reopened.find('ocr', 'hash1', PARAMS)[0] == 'page_1.jpg'
+    # Autre contenu, autres paramètres ou sortie supprimée : à refaire
+    assert not reopened.is_done('ocr', 'page_1.jpg', 'hash2', PARAMS)
+    assert not reopened.is_done('ocr', 'page_1.jpg', 'hash1', {'lang': 'eng'})
+    output.unlink()
+    assert not reopened.is_done('ocr', 'page_1.jpg', 'hash1', PARAMS)
+
+
+def test_interrupted_and_failed_items_are_unfinished(tmp_path):
+    manifest = Manifest.for_directory(str(tmp_path))
+    for item in ('page_1.jpg', 'page_2.jpg', 'page_3.jpg'):
+        manifest.start('ocr', item)
+    manifest.record('ocr', 'page_1.jpg', 'hash1', PARAMS)
+    manifest.fail('ocr', 'page_2.jpg', 'tesseract crashed')
+    manifest.start('split', 'page_4.jpg')
+    # Le processus meurt ici : page_3 reste en cours
+
+    reopened = Manifest.for_directory(str(tmp_path))
+    assert reopened.unfinished('ocr') == {
+        ('ocr', 'page_2.jpg'): (FAILED, 'tesseract crashed'),
+        ('ocr', 'page_3.jpg'): (RUNNING, None),
+    }
+    assert ('split', 'page_4.jpg') in reopened.unfinished()
+    assert reopened.is_done('ocr', 'page_1.jpg', 'hash1', PARAMS)
+
+    reopened.record('ocr', 'page_3.jpg', 'hash3', PARAMS)
+    assert ('ocr', 'page_3.jpg') not in reopened.unfinished('ocr')
+
+
+def test_legacy_json_manifest_is_imported(tmp_path):
+    output = tmp_path / 'page_1.jpg'
+    output.write_bytes(b'jpeg')
+    legacy = {
+        'entries': {'convert:page_1.png': {'input': 'hash1', 'params': Manifest.params_hash(PARAMS),
+                                           'outputs': [str(output)], 'data': {}}},
+        'file_hashes': {'page_1.png': [4, 0, 'hash1']},
+    }
+    (tmp_path / LEGACY_MANIFEST_NAME).write_text(json.dumps(legacy), encoding='utf-8')
+
+    manifest = Manifest.for_directory(str(tmp_path))
+    assert manifest.is_done('convert', 'page_1.png', 'hash1', PARAMS)
+    assert manifest.file_hashes['page_1.png'] == [4, 0, 'hash1']
+    # Une seule importation : le journal SQLite fait foi ensuite
+    (tmp_path / LEGACY_MANIFEST_NAME).write_text(json.dumps({'entries': {}}), encoding='utf-8')
+    assert Manifest.for_directory(str(tmp_path)).is_done('convert', 'page_1.png', 'hash1', PARAMS)
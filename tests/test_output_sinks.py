@@ -0,0 +1,73 @@
+#output sinks: a file appears under its final name only when it is complete
+import csv
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from output_sinks import open_sink
+
+ROWS = [[f"doc{i}", str(i), 'full', f"page_{i}.jpg", f"text {i}", '2024-01-01', 6, 2,
+         f"/tmp/page_{i}.jpg", 'une_image_page'] for i in range(5)]
+
+
+def read_rows(path):
+    if path.suffix == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            return list(csv.reader(f))[1:]
+    if path.suffix == '.jsonl':
+        with open(path, encoding='utf-8') as f:
+            return [list(json.loads(line).values()) for line in f]
+    if path.suffix == '.xlsx':
+        from openpyxl import load_workbook
+        return [list(row) for row in load_workbook(path).active.iter_rows(min_row=2, values_only=True)]
+    import pyarrow.parquet
+    return [list(row.values()) for row in pyarrow.parquet.read_table(path).to_pylist()]
+
+
+@pytest.mark.parametrize('extension', ['csv', 'jsonl', 'xlsx', 'parquet'])
+def test_close_publishes_every_row(tmp_path, extension):
+    if extension == 'parquet':
+        pytest.importorskip('pyarrow')
+    output = tmp_path / f"out.{extension}"
+
+    with open_sink(str(output), checkpoint_every=2) as sink:
+        for row in ROWS:
+            sink.write_row(row)
+        assert not output.exists()
+
+    rows = read_rows(output)
+    assert len(rows) == len(ROWS)
+    assert [str(value) for value in rows[-1]] == [str(value) for value in ROWS[-1]]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [output.name]
+
+
+@pytest.mark.parametrize('extension', ['csv', 'jsonl', 'parquet'])
+def test_error_leaves_no_output(tmp_path, extension):
+    if extension == 'parquet':
+        pytest.importorskip('pyarrow')
+    output = tmp_path / f"out.{extension}"
+
+    with pytest.raises(RuntimeError):
+        with open_sink(str(output), checkpoint_every=2) as sink:
+            for row in ROWS:
+                sink.write_row(row)
+            raise RuntimeError('OCR failed')
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_xlsx_error_keeps_the_checkpoint(tmp_path):
+    output = tmp_path / 'out.xlsx'
+
+    with pytest.raises(RuntimeError):
+        with open_sink(str(output), checkpoint_every=2) as sink:
+            for row in ROWS:
+                sink.write_row(row)
+            raise RuntimeError('OCR failed')
+
+    assert not output.exists()
+    assert len(read_rows(tmp_path / 'out.xlsx.partial.jsonl')) == len(ROWS)
@@ -0,0 +1,25 @@
+#smoke test of the whole pdf2data chain on a generated PDF (text read from the PDF text layer, no Tesseract needed)
+import csv
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+import pdf2data
+from synthetic_pdfs import make_pdf
+
+
+def test_main_writes_one_row_per_image(tmp_path):
+    make_pdf(str(tmp_path / 'pdfs' / 'text.pdf'), 'text', pages=2)
+    output = tmp_path / 'out.csv'
+
+    processed = pdf2data.main([str(tmp_path / 'pdfs'), '-o', str(output),
+                               '--pages-dir', str(tmp_path / 'pages'), '--images-dir', str(tmp_path / 'images'),
+                               '--render-workers', '1', '--split-workers', '1', '--crop-workers', '1',
+                               '--ocr-workers', '1'])
+
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    assert processed > 0
+    assert len(rows) == processed + 1  # header
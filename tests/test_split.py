@@ -0,0 +1,69 @@
+#split detection on a generated page holding two photos
+import io
+import sys
+from pathlib import Path
+
+import fitz
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_double_image_jpg import detect_split_points_batch, split_files
+
+DPI = 100
+ZOOM = DPI / 72
+
+
+def photo(rng, width=900, height=600):
+    """JPEG of a noisy gradient"""
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    pixels = np.clip(base * 0.7 + rng.normal(0, 12, base.shape), 0, 230).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def double_image_page(seed=0):
+    """A4 page of two stacked photos with a caption under each, the gap between them spans 380 to 450 pt"""
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    page.insert_image(fitz.Rect(60, 60, 535, 380), stream=photo(rng))
+    page.insert_image(fitz.Rect(60, 450, 535, 770), stream=photo(rng))
+    page.insert_text((60, 410), 'Vue de la façade nord', fontsize=9)
+    page.insert_text((60, 800), 'Vue de la façade sud', fontsize=9)
+    pix = doc[0].get_pixmap(matrix=fitz.Matrix(ZOOM, ZOOM), alpha=False)
+    image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    doc.close()
+    return image
+
+
+def test_stacked_and_side_by_side_pages_in_one_batch():
+    page = double_image_page()
+    side_by_side = page.transpose(Image.Transpose.ROTATE_90)
+
+    (axis, splits), (rotated_axis, rotated_splits) = detect_split_points_batch([page, side_by_side])
+
+    assert axis == 0 and len(splits) == 1
+    assert 380 * ZOOM < splits[0] < 450 * ZOOM
+    assert rotated_axis == 1 and len(rotated_splits) == 1
+    assert 380 * ZOOM < side_by_side.width - rotated_splits[0] < 450 * ZOOM
+
+
+def test_split_files_cuts_a_jpeg_at_the_gap(tmp_path):
+    image_path = tmp_path / 'page_1.jpg'
+    page = double_image_page()
+    page.save(image_path, 'JPEG', quality=90)
+
+    [(path, outputs, axis, error)] = split_files([(str(image_path), str(tmp_path / 'split'))])
+
+    assert error is None and axis == 0
+    assert sorted(Path(output).name for output in outputs) == ['page_1_bottom.jpg', 'page_1_top.jpg']
+    with Image.open(tmp_path / 'split' / 'page_1_top.jpg') as top, \
+            Image.open(tmp_path / 'split' / 'page_1_bottom.jpg') as bottom:
+        assert top.width == bottom.width == page.width
+        # Découpe alignée sur les blocs de 16 pixels du JPEG
+        assert 380 * ZOOM - 16 < top.height < 450 * ZOOM + 16
+        assert top.height + bottom.height == page.height
@@ -0,0 +1,64 @@
+#text regions sent to the OCR: captions around a photo, the whole image for a framed page
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import extract_text_from_img_to_xls
+from extract_images_completly import ImageContentExtractor
+
+
+def framed_page():
+    """Text page inside a border, taken for one big image by segment_regions"""
+    gray = np.full((1100, 800), 255, np.uint8)
+    cv2.rectangle(gray, (20, 20), (780, 1080), 0, 6)
+    for line in range(12):
+        cv2.putText(gray, 'Lorem ipsum dolor sit amet', (60, 100 + line * 70), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 2)
+    return gray
+
+
+def photo_page():
+    """Photo with its caption below"""
+    gray = np.full((1100, 800), 255, np.uint8)
+    gray[60:700, 60:740] = np.random.default_rng(0).integers(40, 200, (640, 680))
+    cv2.putText(gray, 'Vue de la facade nord', (60, 780), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 2)
+    return gray
+
+
+def ocr_input(monkeypatch, tmp_path, gray):
+    """What ocr_file hands to Tesseract in a worker started with regions=True"""
+    file_path = str(tmp_path / 'page_1.png')
+    cv2.imwrite(file_path, gray)
+    seen = []
+    monkeypatch.setattr(extract_text_from_img_to_xls, '_worker_api', None)
+    monkeypatch.setattr(extract_text_from_img_to_xls, '_worker_extractor', ImageContentExtractor())
+    monkeypatch.setattr(extract_text_from_img_to_xls.pytesseract, 'image_to_string',
+                        lambda image, lang: seen.append(image) or 'texte')
+    assert extract_text_from_img_to_xls.ocr_file(file_path) == ('texte', None)
+    return file_path, seen[0]
+
+
+def test_caption_is_found_outside_the_photo():
+    regions = ImageContentExtractor().text_regions(photo_page())
+    assert len(regions) == 1
+    x, y, w, h = regions[0]
+    assert y > 700 and y + h < 800
+
+
+def test_framed_page_has_no_text_region():
+    assert ImageContentExtractor().text_regions(framed_page()) == []
+
+
+def test_framed_page_is_read_whole(monkeypatch, tmp_path):
+    file_path, image = ocr_input(monkeypatch, tmp_path, framed_page())
+    assert image == file_path
+
+
+def test_only_the_caption_of_a_photo_is_read(monkeypatch, tmp_path):
+    _, image = ocr_input(monkeypatch, tmp_path, photo_page())
+    masked = np.asarray(image)
+    assert (masked[100:650, 100:700] == 255).all()
+    assert (masked[740:800, 60:420] < 128).any()